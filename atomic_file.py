@@ -0,0 +1,24 @@
+import os
+import threading
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path: str, mode="wb"):
+    """
+    Opens a temporary file next to `path` for writing, and replaces `path` with it when the
+    `with` block ends, so that other threads and processes never read a half-written file.
+
+    If the block raises an exception, the temporary file is removed and `path` is not changed.
+
+        with atomic_write("exchange_rates.json", "w") as file:
+            json.dump(data, file)
+    """
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file, mode) as file:
+            yield file
+        os.replace(temp_file, path)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
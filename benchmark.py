@@ -0,0 +1,416 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from number_parser import NumberParser, parse_number
+from currency_index import load_currency_index
+from currency_text_converter import AUTO_DETECT, TextCurrencyConverter, build_replacements, \
+    convert_prices, format_number, rewrite_text
+
+# Currencies used in generated documents with -a AUTO. Includes a right-to-left symbol (AED).
+AUTO_CURRENCIES = ["USD", "EUR", "INR", "AED", "JPY", "GBP", "CHF"]
+
+# Words placed between prices in generated documents
+FILLER_WORDS = ["the", "price", "of", "this", "item", "is", "now", "only", "and", "shipping", "costs",
+                "per", "unit", "total", "order", "with", "discount", "Invoice", "No.", "2024", "ref", "#4512"]
+
+# Modules that must not be imported when the converter starts. They are only imported when they are used.
+DEFERRED_MODULES = ["requests", "price_parser", "asyncio", "multiprocessing", "concurrent.futures.process"]
+
+"""
+Separator styles used for generated amounts.
+
+| Style      | Example        |
+| ---------- | -------------- |
+| plain      | 1234           |
+| standard   | 1,234,567.89   |
+| european   | 1.234.567,89   |
+| space      | 1 234 567      |
+| apostrophe | 1'234'567.50   |
+| indian     | 12,34,567.89   |
+"""
+NUMBER_STYLES = ["plain", "standard", "european", "space", "apostrophe", "indian"]
+
+
+class StaticExchangeRates:
+    '''
+    Stands in for ExchangeRates so that benchmarks never read or download exchange rates.
+    '''
+    def __init__(self, currencies):
+        rng = random.Random(0)
+        self.content = {
+            "time_last_update_unix": 0,
+            "time_next_update_unix": 0,
+            "rates": {currency: round(rng.uniform(0.1, 300), 4) for currency in currencies}
+        }
+
+    def get_rates(self) -> dict:
+        return self.content
+
+
+def generate_amount(rng: random.Random, style: str) -> str:
+    whole = str(rng.choice([rng.randint(1, 999), rng.randint(1000, 999999), rng.randint(1000000, 99999999)]))
+    cents = f"{rng.randint(0, 99):02d}"
+
+    if style == "plain":
+        return whole
+
+    if style == "indian":
+        groups = [whole[-3:]]
+        rest = whole[:-3]
+        while rest:
+            groups.insert(0, rest[-2:])
+            rest = rest[:-2]
+        return ",".join(groups) + "." + cents
+
+    thousands_separator, decimal_separator = {
+        "standard": (",", "."),
+        "european": (".", ","),
+        "space": (" ", None),
+        "apostrophe": ("'", "."),
+    }[style]
+
+    groups = []
+    while whole:
+        groups.insert(0, whole[-3:])
+        whole = whole[:-3]
+    amount = thousands_separator.join(groups)
+
+    if decimal_separator is not None:
+        amount += decimal_separator + cents
+    return amount
+
+
+def generate_price(rng: random.Random, symbol: str, condition: dict, style: str) -> str:
+    amount = generate_amount(rng, style)
+
+    if condition["spaces_allowed"] == "forbidden":
+        space = ""
+    elif condition["spaces_allowed"] == "required":
+        space = " "
+    else:
+        space = rng.choice(["", " "])
+
+    # PriceParser looks for the number after the symbol when the symbol can only be placed after a number
+    if condition["placed_before"] and (not condition["placed_after"] or rng.random() < 0.5):
+        return amount + space + symbol
+    return symbol + space + amount
+
+
+def generate_document(currency_index, currency_from: str, size: int, density: float, seed=0) -> str:
+    """
+    Returns a synthetic document of about `size` characters with about `density` prices per
+    1,000 characters, written with the real symbols of `currency_from` (or of AUTO_CURRENCIES
+    if `currency_from` is AUTO) and a mix of separator styles.
+    """
+    rng = random.Random(seed)
+
+    if currency_from == AUTO_DETECT:
+        currencies = AUTO_CURRENCIES
+    else:
+        currencies = [currency_from]
+
+    symbols = []
+    for currency in currencies:
+        for symbol, condition in currency_index.symbol_conditions[currency].items():
+            if symbol:
+                symbols.append((symbol, condition))
+
+    price_probability = density / 1000 * 6
+    parts = []
+    length = 0
+    while length < size:
+        if rng.random() < price_probability:
+            symbol, condition = rng.choice(symbols)
+            part = generate_price(rng, symbol, condition, rng.choice(NUMBER_STYLES))
+        else:
+            part = rng.choice(FILLER_WORDS)
+
+        # Separate prices from the surrounding words so that amounts are not joined together
+        separator = "\n" if rng.random() < 0.05 else " | "
+        parts.append(part)
+        parts.append(separator)
+        length += len(part) + len(separator)
+
+    return "".join(parts)
+
+
+def time_stage(function, repeat: int, items: int) -> dict:
+    """
+    Runs `function` `repeat` times and returns the best and mean time in seconds.
+    `items` is the number of items (texts, prices, ...) processed per run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    best = min(times)
+    return {
+        "best_s": best,
+        "mean_s": sum(times) / len(times),
+        "items": items,
+        "items_per_s": items / best if best > 0 else None
+    }
+
+
+def run_benchmarks(text: str, currency_from: str, currency_to: str, repeat: int) -> dict:
+    converter = TextCurrencyConverter(exchange_rates=StaticExchangeRates(load_currency_index().valid_currencies))
+    currency_converter = converter.currency_converter
+    matcher = converter.get_price_matcher(currency_from)
+
+    def find_symbol():
+        return matcher.find_prices(text)
+
+    prices = [price for price in find_symbol() if price['currency'] != currency_to]
+    amounts = [price['amount'] for price in prices]
+    places = converter.currency_data[currency_to]["ISOdigits"]
+    converted_values = convert_prices(prices, currency_converter, currency_from, currency_to, places)
+    new_symbols = converter.currency_index.target_symbols[currency_to]
+    replacements = build_replacements(prices, converted_values, new_symbols)
+    converted_numbers = [str(currency_converter.convert(price, price['currency'], currency_to)) for price in prices]
+
+    def parse_numbers():
+        for amount in amounts:
+            NumberParser(amount).find()
+
+    def parse_numbers_cached():
+        for amount in amounts:
+            parse_number(amount)
+
+    def convert():
+        for price in prices:
+            currency_converter.convert(price, price['currency'], currency_to)
+
+    def format_numbers():
+        for number in converted_numbers:
+            format_number(number)
+
+    stages = {
+        "find_symbol": (find_symbol, 1),
+        "number_parser_find": (parse_numbers, len(amounts)),
+        "parse_number_cached": (parse_numbers_cached, len(amounts)),
+        "currency_converter_convert": (convert, len(prices)),
+        "format_number": (format_numbers, len(converted_numbers)),
+        "convert_prices": (lambda: convert_prices(prices, currency_converter, currency_from, currency_to, places), len(prices)),
+        "rewrite_text": (lambda: rewrite_text(text, replacements), len(replacements)),
+        "full_pipeline": (lambda: converter.convert_text(text, currency_from, currency_to, currency_converter), 1),
+    }
+
+    results = {}
+    for name, (function, items) in stages.items():
+        results[name] = time_stage(function, repeat, items)
+
+    return {"num_prices": len(prices), "stages": results}
+
+
+def check_startup(repeat: int) -> dict:
+    """
+    Imports currency_text_converter in a new interpreter `repeat` times. Returns the best import
+    time and the modules in DEFERRED_MODULES that were imported anyway.
+    """
+    code = ("import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "import currency_text_converter\n"
+            "import_s = time.perf_counter() - start\n"
+            f"print(json.dumps({{'import_s': import_s, 'loaded': [m for m in {DEFERRED_MODULES!r} if m in sys.modules]}}))")
+
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output)
+        times.append(result["import_s"])
+
+    return {"best_s": min(times), "loaded": result["loaded"]}
+
+
+def check_refresh(threads: int, delay: float) -> dict:
+    """
+    Calls AsyncExchangeRates.get_rates() from `threads` threads at once, without an event loop,
+    while the saved rates are outdated. New rates are served by a local stub server that waits
+    `delay` seconds before it responds. Returns the longest time a call took and the number of
+    downloads, after the background download has finished.
+    """
+    from update_exchange_rates import AsyncExchangeRates
+
+    downloads = []
+
+    class StubRatesHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            downloads.append(self.path)
+            time.sleep(delay)
+            now = int(time.time())
+            body = json.dumps({"time_last_update_unix": now, "time_next_update_unix": now + 24 * 60 * 60,
+                               "rates": {"USD": 1, "EUR": 0.9}}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubRatesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        exchange_rate_file = os.path.join(directory, "exchange_rates.json")
+        with open(exchange_rate_file, "w") as file:
+            json.dump({"time_last_update_unix": 0, "time_next_update_unix": 1, "rates": {"USD": 1, "EUR": 0.5}}, file)
+
+        exchange_rates = AsyncExchangeRates(exchange_rate_file, f"http://127.0.0.1:{server.server_port}/", history_file=None)
+        exchange_rates.get_rates()
+
+        times = []
+        def get_rates():
+            start = time.perf_counter()
+            exchange_rates.get_rates()
+            times.append(time.perf_counter() - start)
+
+        callers = [threading.Thread(target=get_rates) for _ in range(threads)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+
+        exchange_rates.refresh_thread.join()
+        server.shutdown()
+        server.server_close()
+
+        return {"longest_s": max(times), "downloads": len(downloads), "rate": exchange_rates.get_rates()["rates"]["EUR"]}
+
+
+def compare(results: dict, baseline: dict):
+    print(f"{'Stage':<30}{'Baseline (s)':>15}{'Current (s)':>15}{'Change':>10}")
+    for name, current in results["stages"].items():
+        if name not in baseline["stages"]:
+            print(f"{name:<30}{'-':>15}{current['best_s']:>15.6f}{'-':>10}")
+            continue
+
+        before = baseline["stages"][name]["best_s"]
+        change = (current["best_s"] - before) / before * 100 if before > 0 else 0
+        print(f"{name:<30}{before:>15.6f}{current['best_s']:>15.6f}{change:>9.1f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the currency text converter on a synthetic document.")
+
+    parser.add_argument('-a', '--currency_from',
+                        default='USD',
+                        help=f'Currency of the prices in the document, or {AUTO_DETECT} for a mix of currencies. Default: USD')
+    parser.add_argument('-b', '--currency_to',
+                        default='EUR',
+                        help='Currency to convert to. Default: EUR')
+    parser.add_argument('--size',
+                        type=int,
+                        default=1000000,
+                        help='Number of characters in the generated document. Default: 1000000')
+    parser.add_argument('--density',
+                        type=float,
+                        default=5,
+                        help='Number of prices per 1,000 characters. Default: 5')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Seed of the document generator. Default: 0')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help='Number of times each stage is run. The best time is reported. Default: 5')
+    parser.add_argument('-f', '--file',
+                        help='Benchmark this file instead of a generated document.')
+    parser.add_argument('--generate',
+                        metavar='PATH',
+                        help='Only write the generated document to PATH.')
+    parser.add_argument('-o', '--output_file',
+                        help='Write the results as JSON to this file.')
+    parser.add_argument('--baseline',
+                        help='JSON results of an earlier run to compare against.')
+    parser.add_argument('--startup',
+                        action='store_true',
+                        help='Only time how long the converter takes to import. Fails if a module that should be imported on first use is imported at startup, or if --max_import_time is exceeded.')
+    parser.add_argument('--refresh',
+                        action='store_true',
+                        help='Only check that AsyncExchangeRates returns outdated rates without waiting while new rates are downloaded from a local stub server. Fails if a call waits for the download or if the rates are downloaded more than once.')
+    parser.add_argument('--max_import_time',
+                        type=float,
+                        help='With --startup, the longest import time in seconds that is accepted.')
+
+    args = parser.parse_args()
+    args.currency_from = args.currency_from.upper()
+    args.currency_to = args.currency_to.upper()
+
+    if args.startup:
+        startup = check_startup(args.repeat)
+        print(f"Imported currency_text_converter in {startup['best_s']:.4f} seconds.")
+
+        if startup["loaded"]:
+            print(f"Modules imported at startup that should only be imported when used: {', '.join(startup['loaded'])}")
+            sys.exit(1)
+        if args.max_import_time != None and startup["best_s"] > args.max_import_time:
+            print(f"Import took longer than {args.max_import_time} seconds.")
+            sys.exit(1)
+        sys.exit()
+
+    if args.refresh:
+        delay = 1
+        refresh = check_refresh(threads=20, delay=delay)
+        print(f"Longest call took {refresh['longest_s']:.4f} seconds. Rates were downloaded {refresh['downloads']} time(s).")
+
+        if refresh["longest_s"] >= delay / 2:
+            print("get_rates() waited for the download.")
+            sys.exit(1)
+        if refresh["downloads"] != 1 or refresh["rate"] != 0.9:
+            print("The rates were not downloaded exactly once.")
+            sys.exit(1)
+        sys.exit()
+
+    if args.file != None:
+        with open(args.file) as file:
+            text = file.read()
+    else:
+        text = generate_document(load_currency_index(), args.currency_from, args.size, args.density, args.seed)
+
+    if args.generate != None:
+        with open(args.generate, "w") as file:
+            file.write(text)
+        sys.exit()
+
+    results = {
+        "config": {
+            "currency_from": args.currency_from,
+            "currency_to": args.currency_to,
+            "size": len(text),
+            "density": args.density,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "file": args.file
+        },
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        **run_benchmarks(text, args.currency_from, args.currency_to, args.repeat)
+    }
+
+    if args.baseline != None:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
+    else:
+        print(f"{'Stage':<30}{'Best (s)':>12}{'Items':>10}{'Items/s':>14}")
+        for name, stage in results["stages"].items():
+            items_per_s = f"{stage['items_per_s']:.0f}" if stage['items_per_s'] else "-"
+            print(f"{name:<30}{stage['best_s']:>12.6f}{stage['items']:>10}{items_per_s:>14}")
+
+    if args.output_file != None:
+        with open(args.output_file, "w") as file:
+            json.dump(results, file, indent=4)
@@ -0,0 +1,171 @@
+import json
+import os
+import pickle
+
+from atomic_file import atomic_write
+from parser import get_symbol_condition
+
+
+# Currency that an ambiguous symbol stands for when currencies are detected automatically.
+# Ambiguous symbols that are not listed here are not converted.
+DEFAULT_SYMBOL_CURRENCIES = {
+    "$": "USD",
+    "DOLLAR": "USD",
+    "DOLLARS": "USD",
+    "£": "GBP",
+    "POUND": "GBP",
+    "POUNDS": "GBP",
+    "Rs.": "INR",
+    "RUPEE": "INR",
+    "RUPEES": "INR",
+    "PESO": "MXN",
+    "PESOS": "MXN",
+    "FRANC": "CHF",
+    "FRANCS": "CHF",
+    "Fr.": "CHF",
+    "₩": "KRW",
+    "WON": "KRW",
+    "₱": "PHP",
+    "RUBLE": "RUB",
+    "RUBLES": "RUB",
+    "RIYAL": "SAR",
+    "RIYALS": "SAR",
+}
+
+# ISO codes that are also common English words (e.g. "TOP 10 PICKS" or "ALL 3 ITEMS"). When
+# currencies are detected automatically, they are treated like ambiguous symbols and are only
+# converted if they are listed in the symbol defaults, e.g. --symbol_default "TRY=TRY".
+WORD_LIKE_CODES = frozenset([
+    "ALL", "BAM", "BOB", "CUP", "GEL", "MAD", "MOP", "PEN", "SOS", "TOP", "TRY"
+])
+
+
+class CurrencyIndex:
+    '''
+    Holds everything the converter needs from `currencies.json` and `valid_currencies.txt`.
+
+    - currencies: the data of each currency in currencies.json.
+    - valid_currencies: frozenset of the currencies listed in valid_currencies.txt.
+    - symbol_conditions: the `PriceParser.SYMBOL_CONDITION` of each currency.
+    - target_symbols: the symbols that replace each symbol type when converting to a currency.
+    - symbol_currencies: every valid currency that each symbol can stand for.
+
+    Use `load_currency_index()` to create a CurrencyIndex. It caches the index next to
+    currencies.json, so the JSON file is only parsed again when either file changes.
+    '''
+
+    # Increase when the layout of the index changes so that old cache files are rebuilt
+    VERSION = 2
+
+    def __init__(self, currencies: dict, valid_currencies):
+        self.currencies = currencies
+        self.valid_currencies = frozenset(valid_currencies)
+        self.symbol_conditions = {}
+        self.target_symbols = {}
+        self.symbol_currencies = {}
+
+        for currency, currency_data in currencies.items():
+            self.symbol_conditions[currency] = get_symbol_condition(currency, currency_data)
+            self.target_symbols[currency] = get_target_symbols(currency, currency_data)
+
+            if currency not in self.valid_currencies:
+                continue
+
+            for symbol in self.symbol_conditions[currency]:
+                if symbol:
+                    self.symbol_currencies.setdefault(symbol, []).append(currency)
+
+    def get_detection_symbol_condition(self, symbol_defaults=DEFAULT_SYMBOL_CURRENCIES, word_like_codes=WORD_LIKE_CODES) -> dict:
+        """
+        Returns a `PriceParser.SYMBOL_CONDITION` with the symbols of every valid currency, so that
+        the prices of all currencies in a text are found in a single scan.
+
+        Each condition has an extra "currency" key with the currency the symbol stands for.
+        A symbol used by more than one currency (e.g. "$") stands for the currency in
+        `symbol_defaults`. Ambiguous symbols missing from `symbol_defaults` are left out.
+        Symbols in `word_like_codes` are ambiguous with English words, so they are also left
+        out unless they are in `symbol_defaults`.
+        """
+        symbol_condition = {}
+        for symbol, currencies in self.symbol_currencies.items():
+            if symbol in symbol_defaults:
+                currency = symbol_defaults[symbol]
+            elif symbol in word_like_codes:
+                continue
+            elif len(currencies) == 1:
+                currency = currencies[0]
+            else:
+                continue
+
+            # Use the default currency's own condition if the symbol is one of its symbols
+            source = currency if currency in currencies else currencies[0]
+            symbol_condition[symbol] = {**self.symbol_conditions[source][symbol], "currency": currency}
+
+        return symbol_condition
+
+
+def get_target_symbols(currency_to: str, curr_to_data: dict) -> dict:
+    """
+    Returns the symbol of `currency_to` to use for each symbol type found by PriceParser.
+    """
+    # Get name and plural name of currency_to
+    name = curr_to_data["name"].replace(curr_to_data["demonym"], "") # Remove demonym from currency
+    plural_name = name.replace(curr_to_data["majorSingle"], curr_to_data["majorPlural"])
+    name = name.strip()
+    plural_name = plural_name.strip()
+
+    return {
+        "ISO": currency_to,
+        "symbol": curr_to_data["symbol"],
+        "symbol_native": curr_to_data["symbolNative"],
+        "denonym_name": curr_to_data["name"],
+        "name": name,
+        "plural_name": plural_name
+    }
+
+
+def get_file_stamp(path: str) -> tuple:
+    # A file is treated as changed if its modification time or size changes
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_currency_index(currencies_file='currencies.json', valid_currencies_file='valid_currencies.txt', cache_file=None) -> CurrencyIndex:
+    """
+    Returns the CurrencyIndex of `currencies_file` and `valid_currencies_file`.
+
+    The index is read from `cache_file` (by default, "currencies.index.pickle" next to
+    `currencies_file`) if the cache was built by the same CurrencyIndex.VERSION from files with
+    the same modification time and size. Otherwise, the index is built from the two files
+    and the cache is written again.
+    """
+    if cache_file is None:
+        cache_file = os.path.splitext(currencies_file)[0] + ".index.pickle"
+
+    stamp = (CurrencyIndex.VERSION, get_file_stamp(currencies_file), get_file_stamp(valid_currencies_file))
+
+    try:
+        with open(cache_file, "rb") as file:
+            cached_stamp, index = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        pass
+    else:
+        if cached_stamp == stamp:
+            return index
+
+    with open(currencies_file) as file:
+        currencies = json.load(file)
+
+    with open(valid_currencies_file) as file:
+        valid_currencies = file.read().splitlines()
+
+    index = CurrencyIndex(currencies, valid_currencies)
+
+    try:
+        with atomic_write(cache_file) as file:
+            pickle.dump((stamp, index), file, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        # The index still works without a cache, e.g. if the directory is read-only
+        pass
+
+    return index
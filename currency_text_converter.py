@@ -1,37 +1,93 @@
 import json
 import argparse
-import re
-from number_parser import NumberParser
-from parser import PriceParser
+import glob
+import mmap
+import os
+import sys
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime, timedelta, UTC
+from parser import PriceMatcher, compile_byte_symbol_scanner, compile_symbol_scanner, get_price_matcher, get_symbol_condition
+from currency_index import DEFAULT_SYMBOL_CURRENCIES, get_target_symbols, load_currency_index
 from update_exchange_rates import ExchangeRates
-import subprocess
-import time
-from decimal import Decimal, ROUND_DOWN
+from rate_snapshot import get_rate_snapshot
+from instrumentation import PROFILER
+from result_cache import DISK_SIZE, ResultCache
+from segment_cache import SegmentCache
+from decimal import Decimal, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_UP
+from functools import lru_cache
+
+# Number of characters read at a time in streaming mode
+CHUNK_SIZE = 1024 * 1024
+
+# Number of characters carried over between chunks in streaming mode. Must be longer than any
+# currency symbol plus the amount next to it.
+CHUNK_OVERLAP = 256
+
+# Largest number of characters searched for a safe place to split a chunk in streaming mode. If a
+# chunk ends in a longer run of digits or letters, it is split anyway so the buffer cannot keep growing.
+MAX_CARRY_OVER = 64 * 1024
+
+# Number of characters sent to a worker process at a time with --workers
+SHARD_SIZE = 1024 * 1024
+
+# Characters that may appear inside an amount. See `number_parser.SEPARATORS`.
+NUMBER_SEPARATORS = [",", ".", "_", " ", "'"]
+
+
+# Rounding modes that can be chosen with --rounding. Converted prices are rounded down by default.
+ROUNDING_MODES = {
+    "down": ROUND_DOWN,
+    "up": ROUND_UP,
+    "half_up": ROUND_HALF_UP,
+    "half_even": ROUND_HALF_EVEN,
+    "ceiling": ROUND_CEILING,
+    "floor": ROUND_FLOOR
+}
+
+# Use as `currency_from` to find and convert the prices of every currency
+AUTO_DETECT = "AUTO"
+
+# Exchange rates shared by every conversion in this process. See `ExchangeRates.get_rates`.
+EXCHANGE_RATES = ExchangeRates()
 
 
 class CurrencyConverter:
-    def __init__(self, exchange_rate_file='exchange_rates.json'):
-        self.exchange_rate_file = exchange_rate_file
-        with open(self.exchange_rate_file) as file:
-            data = json.load(file)
+    '''
+    Converts amounts between currencies using `rate_table`, the exchange rates returned by `ExchangeRates.get_rates()`.
 
-        self.exchange_rates = data["rates"]
+    The rates are read from the RateSnapshot of `rate_table` (see `get_rate_snapshot`), so each
+    conversion is a single multiplication by a precomputed cross rate. Every conversion made
+    by one CurrencyConverter uses the same snapshot, given by self.snapshot.version.
+    '''
+    def __init__(self, rate_table: dict):
+        self.rate_table = rate_table
+        self.exchange_rates = rate_table["rates"]
+        self.snapshot = get_rate_snapshot(rate_table)
 
     def convert(self, amount_from: float, currency_from: str, currency_to: str) -> float:
-        currencies = [currency_from.upper(), currency_to.upper()]
-        for currency in currencies:
-            try:
-                self.exchange_rates[currency]
-            except:
-                raise KeyError(f"{currency} not found in {self.exchange_rate_file}.")
+        # Raises KeyError if either currency is not in the exchange rates
+        return amount_from['value'].number * self.snapshot.cross_rate(currency_from.upper(), currency_to.upper())
+
+    def cross_rate(self, currency_from: str, currency_to: str) -> Decimal:
+        """
+        Returns the exact exchange rate from `currency_from` to `currency_to` as a Decimal.
+        See `RateSnapshot.exact_cross_rate`.
+        """
+        return self.snapshot.exact_cross_rate(currency_from, currency_to)
 
-        # Convert amount_from to USD
-        USD_rate = self.exchange_rates[currency_from]
-        USD_amount = amount_from['value']['number'] / USD_rate
+    def convert_exact(self, amounts: list, currency_from: str, currency_to: str, places=2, rounding=ROUND_DOWN) -> list:
+        """
+        Converts every Decimal in `amounts` from `currency_from` to `currency_to` and rounds the
+        results to `places` decimal places with the `decimal` rounding mode `rounding`.
 
-        # Convert USD_amount to target currency
-        amount_to = USD_amount * self.exchange_rates[currency_to]
-        return amount_to
+        Example:
+        >>> CurrencyConverter({"rates": {"USD": 1, "JPY": 150.25}}).convert_exact([Decimal("9.99")], "USD", "JPY", places=0)
+        [Decimal('1500')]
+        """
+        rate = self.cross_rate(currency_from.upper(), currency_to.upper())
+        quantum = Decimal(1).scaleb(-places)
+        return [(amount * rate).quantize(quantum, rounding=rounding) for amount in amounts]
 
 
 def format_number(num: str, thousands_separator=",", decimal_separator=".", uses_indian_thousands_system=False) -> str:
@@ -103,120 +159,891 @@ def format_number(num: str, thousands_separator=",", decimal_separator=".", uses
     formatted_number = thousands_separator.join(formatted_parts)
     formatted_number = formatted_number[::-1]
     
-    # Add the decimal part back if it exists
-    if decimal_part != '' and decimal_part != '00':
+    # Add the decimal part back if it exists and is not only zeros
+    if decimal_part.strip("0") != '':
+        # Prices have at least two decimal places, e.g. "5.5" becomes "5.50"
+        if len(decimal_part) == 1:
+            decimal_part += "0"
         formatted_number += decimal_separator + decimal_part
-        formatted_number = formatted_number.replace(decimal_separator + "0", decimal_separator + "00")
 
     return formatted_number
 
 
-def main(text, currency_from, currency_to, output_file):
-    with open('currencies.json') as file:
-        data = json.load(file)
+@lru_cache(maxsize=None)
+def get_number_formatter(thousands_separator=",", uses_indian_thousands_system=False):
+    """
+    Returns a function that formats a number string in the same way as
+    `format_number(num, thousands_separator, ".", uses_indian_thousands_system)`.
 
-    # Find all prices in text that use currency_from
-    print("Finding prices...")
-    start = time.time()
-    currency_data = data[currency_from]
-    price_parser = PriceParser(currency_from, currency_data, text)
-    price_parser.find_symbol()
-    end = time.time()
-    print("\tPrices found.")
+    The formatter is cached, so the separator rules of each style are only set up once.
+    Use this instead of `format_number` when many numbers are formatted in the same style.
+    """
+    if uses_indian_thousands_system:
+        def formatter(num: str) -> str:
+            return format_number(num, thousands_separator, ".", True)
+        return formatter
 
-    # Get current exchange rates
-    print("Updating exchange rates...")
-    update_rates_cmd = "python update_exchange_rates.py".split()
-    subprocess.run(update_rates_cmd)
+    def formatter(num: str) -> str:
+        integer_part, _, decimal_part = num.partition(".")
 
-    # Convert currencies
-    currency_converter = CurrencyConverter()
-    converted_values = []
-    print(f"Converting currencies from {currency_from} to {currency_to}...")
-    for result in price_parser.prices:
-        converted = currency_converter.convert(result, currency_from, currency_to)
+        # Python's grouping uses "," as the thousands separator
+        formatted_number = f"{int(integer_part):,}"
+        if thousands_separator != ",":
+            formatted_number = formatted_number.replace(",", thousands_separator)
 
-        # Round based on number of decimal places in original number
-        try:
-            decimal_pos = result['value']['separator_positions']['decimal'][1]
-            num_decimal_places = decimal_pos-1
-        except:
-            num_decimal_places = 0
+        if decimal_part.strip("0") != '':
+            if len(decimal_part) == 1:
+                decimal_part += "0"
+            formatted_number += "." + decimal_part
 
-        # Convert to price notation (with 2 decimal places)
-        price = Decimal(str(converted)).quantize(Decimal(".01"), rounding=ROUND_DOWN)
+        return formatted_number
 
-        price = str(price)
+    return formatter
 
-        # Get decimal separator if it exists
-        try:
-            decimal_separator = result['value']['separator_positions']['decimal'][0]
-        except:
-            decimal_separator = None
 
-        # Add thousands separators if present in original string
-        thousands_separators = result['value']['separator_positions']['thousands']
+def rewrite_text(text: str, replacements: list) -> str:
+    """
+    Builds a new text from `text` in one left-to-right pass.
+
+    `replacements` is a list of (start, end, new_text) tuples. `text[start:end]` is replaced
+    with `new_text`. A replacement that overlaps an earlier replacement is skipped, so a span
+    is never rewritten twice.
+
+    Example:
+    >>> rewrite_text("$5 and $5", [(1, 2, "7"), (0, 1, "€"), (8, 9, "7"), (7, 8, "€")])
+    '€7 and €7'
+    """
+    parts = []
+    position = 0
+    for start, end, new_text in sorted(replacements, key=lambda replacement: replacement[0]):
+        if start < position:
+            continue
+
+        parts.append(text[position:start])
+        parts.append(new_text)
+        position = end
+
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def convert_prices(prices: list, currency_converter, currency_from: str, currency_to: str, places=2, rounding=ROUND_DOWN) -> list:
+    """
+    Converts each price found by PriceParser from `currency_from` to `currency_to`. If a price
+    has its own currency (e.g. when currencies are detected automatically), that currency is used.
+
+    The exact value of each amount is converted with Decimals and rounded to `places` decimal
+    places (the ISOdigits of `currency_to`) with the rounding mode `rounding`.
+
+    Each converted amount is formatted with the same thousands separator and numbering
+    system as the original amount. Returns the formatted amounts in the order of `prices`.
+    """
+    # Group prices by currency so that each currency pair is converted in a single call
+    currency_indices = {}
+    for i, result in enumerate(prices):
+        currency_indices.setdefault(result.get('currency', currency_from), []).append(i)
+
+    converted_values = [None] * len(prices)
+    for currency, indices in currency_indices.items():
+        with PROFILER.stage("conversion"):
+            amounts = [prices[i]['value'].decimal for i in indices]
+            converted_amounts = currency_converter.convert_exact(amounts, currency, currency_to, places, rounding)
+
+        with PROFILER.stage("formatting"):
+            for i, converted in zip(indices, converted_amounts):
+                value = prices[i]['value']
+
+                # Add thousands separators if present in original string
+                formatter = get_number_formatter(value.thousands_separator, value.uses_indian_thousands_system)
+                converted_values[i] = formatter(str(converted))
+
+    return converted_values
+
+
+def build_replacements(prices: list, converted_values: list, new_symbols: dict) -> list:
+    """
+    Returns the (start, end, new_text) replacements for `rewrite_text` that swap each
+    price's amount and symbol for the converted amount and the symbol of the target currency.
+
+    A price's symbol and amount are replaced together or not at all, so an amount is never
+    labelled with the new symbol without being converted. A price that overlaps an earlier
+    price is skipped, unless it labels the same amount (e.g. "USD" in "$5 USD"), in which case
+    only its symbol is replaced.
+    """
+    replacements = []
+
+    # Spans that are already replaced, sorted by start. They never overlap each other.
+    replaced_spans = []
+    amount_spans = set()
+    for price, converted_value in zip(prices, converted_values):
+        price_replacements = [(*price['symbol_span'], new_symbols[price['symbol_type']])]
+        if price['amount_span'] not in amount_spans:
+            price_replacements.append((*price['amount_span'], converted_value))
+
+        if any(overlaps(replaced_spans, start, end) for start, end, new_text in price_replacements):
+            continue
+
+        for start, end, new_text in price_replacements:
+            insort(replaced_spans, (start, end))
+        amount_spans.add(price['amount_span'])
+        replacements.extend(price_replacements)
+
+    return replacements
+
+
+def overlaps(spans: list, start: int, end: int) -> bool:
+    # Returns True if (start, end) overlaps one of `spans`, a sorted list of spans that do not overlap each other
+    i = bisect_left(spans, (start, end))
+    return (i > 0 and spans[i-1][1] > start) or (i < len(spans) and spans[i][0] < end)
+
+
+def find_safe_cut(text: str, limit: int, symbol_scanner, max_carry_over=MAX_CARRY_OVER) -> int:
+    """
+    Returns the largest index at or before `limit` where `text` can be split without
+    splitting a currency symbol, an amount or the space between them.
+
+    `symbol_scanner` is the compiled scanner of the currency's symbols (see `compile_symbol_scanner`).
+    A price is a symbol, at most one space and an amount made of digits and separators, so an
+    index that is not inside a symbol and has no digit, separator or space on either side can
+    never split a price.
+
+    Returns 0 if there is no such index. Only the `max_carry_over` characters before `limit` are
+    searched, so if there is no safe index among them (e.g. in a long run of digits), `limit`
+    is returned instead and the text is split there.
+    """
+    cut = max(0, min(limit, len(text)))
+    forced_cut = cut
+    lowest_cut = max(0, cut - max_carry_over)
+
+    # Symbols that overlap the region being searched. No symbol is longer than CHUNK_OVERLAP.
+    scan_start = max(0, lowest_cut - CHUNK_OVERLAP)
+    spans = [match.span() for match in symbol_scanner.finditer(text, scan_start, min(cut + CHUNK_OVERLAP, len(text)))]
+    span_index = len(spans) - 1
+
+    while cut > lowest_cut:
+        # Skip symbols that start at or after the cut
+        while span_index >= 0 and spans[span_index][0] >= cut:
+            span_index -= 1
+
+        # A number or a separator on either side of the cut may belong to an amount. Words are not
+        # split either, since a piece of a word could be matched as a symbol on its own.
+        before = text[cut-1]
+        after = text[cut] if cut < len(text) else ""
+        is_numeric = before.isdecimal() or before in NUMBER_SEPARATORS or \
+            after.isdecimal() or after in NUMBER_SEPARATORS or \
+            (before.isalpha() and after.isalpha())
+
+        # Symbols do not overlap, so only the closest symbol before the cut can contain it
+        inside_symbol = span_index >= 0 and spans[span_index][1] > cut
+        if not is_numeric and not inside_symbol:
+            return cut
+
+        cut -= 1
+
+    return forced_cut if lowest_cut > 0 else 0
+
+
+def convert_stream(input_file, output_file, currency_from: str, currency_to: str, currency_data: dict,
+                   curr_to_data: dict, currency_converter, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP,
+                   symbol_condition=None, whole_words=False, rounding=ROUND_DOWN) -> int:
+    """
+    Converts the text read from `input_file` and writes it to `output_file` in chunks of
+    `chunk_size` characters, so only about `chunk_size + overlap` characters are held in memory.
+
+    The last `overlap` characters of each chunk are carried over to the next chunk, and the
+    split point is moved back until it does not fall inside a price. A price that is split
+    across two reads (e.g. "1,234" + ",567 USD") is therefore still found.
+
+    `symbol_condition` is the `PriceParser.SYMBOL_CONDITION` to use. By default, it is built from `currency_data`.
+    `whole_words` is passed on to PriceParser. Converted prices are rounded with the rounding mode `rounding`.
+
+    Returns the number of prices converted.
+    """
+    new_symbols = get_target_symbols(currency_to, curr_to_data)
+    if symbol_condition is None:
+        symbol_condition = get_symbol_condition(currency_from, currency_data)
+    matcher = PriceMatcher(currency_from, symbol_condition, whole_words)
+    symbol_scanner = compile_symbol_scanner(tuple(symbol_condition.keys()))
+    places = curr_to_data["ISOdigits"]
+    num_prices = 0
+    buffer = ""
+
+    while True:
+        chunk = input_file.read(chunk_size)
+        at_end = chunk == ""
+        buffer += chunk
+        if buffer == "":
+            break
+
+        if at_end:
+            cut = len(buffer)
+        else:
+            cut = find_safe_cut(buffer, len(buffer) - overlap, symbol_scanner)
+
+        # Convert the text before the cut. The rest is carried over to the next chunk.
+        text = buffer[:cut]
+        prices = [price for price in matcher.find_prices(text) if price['currency'] != currency_to]
+        converted_values = convert_prices(prices, currency_converter, currency_from, currency_to, places, rounding)
+        with PROFILER.stage("rewrite"):
+            replacements = build_replacements(prices, converted_values, new_symbols)
+            text = rewrite_text(text, replacements)
+
+        with PROFILER.stage("output_write"):
+            output_file.write(text)
+        num_prices += len(prices)
+        buffer = buffer[cut:]
+
+        if at_end:
+            break
+
+    return num_prices
+
+
+class TextCurrencyConverter:
+    """
+    Converts the prices in texts from one currency to another.
+
+    The currency data, the list of valid currencies and the exchange rates are loaded once when
+    the object is created, so one object can convert any number of texts.
+
+    If `currency_from` is AUTO_DETECT, the prices of every currency are found and converted.
+    `symbol_defaults` maps ambiguous symbols such as "$" to the currency they stand for and
+    is added to `DEFAULT_SYMBOL_CURRENCIES`.
+
+    Converted prices are rounded to the number of decimal places of the currency they are
+    converted to (e.g. 0 for JPY and 3 for KWD) with the `decimal` rounding mode `rounding`.
+
+    If `result_cache` (a ResultCache) is given, `convert_text` returns the stored result for a
+    text that was already converted with the same currencies and exchange rates.
+
+    If `segment_cache` (a SegmentCache) is given, the prices found in each line are remembered,
+    so only the lines that changed are searched again when an edited text is converted.
+
+    If `rates_time` (Unix time) is given, texts are converted with the exchange rates that were
+    in effect at that time, read from the rate history (see `RateHistory`), instead of the latest rates.
+
+    Example usage:
+
+        converter = TextCurrencyConverter()
+        converter.convert_many(["The car costs €10 000.", "It costs 5 EUR."], "EUR", "USD")
+        converter.convert("It costs €5 or 6 CAD.", AUTO_DETECT, "USD")
+    """
+    def __init__(self, currencies_file='currencies.json', valid_currencies_file='valid_currencies.txt', exchange_rates=EXCHANGE_RATES,
+                 symbol_defaults=None, rounding=ROUND_DOWN, result_cache=None,
+                 segment_cache=None, rates_time=None):
+        self.currencies_file = currencies_file
+        self.valid_currencies_file = valid_currencies_file
+        self.symbol_defaults = {**DEFAULT_SYMBOL_CURRENCIES, **(symbol_defaults or {})}
+        self.detection_symbol_condition = None
+        self.rounding = rounding
+
+        # Identifies the data that symbol conditions are built from. See `get_price_matcher`.
+        self.matcher_options = (os.path.abspath(currencies_file), tuple(sorted(self.symbol_defaults.items())))
+
+        self.result_cache = result_cache
+        self.cache_options = (self.matcher_options, str(rounding))
+        self.segment_cache = segment_cache
+
+        self.currency_index = load_currency_index(currencies_file, valid_currencies_file)
+        self.currency_data = self.currency_index.currencies
+        self.valid_currencies = self.currency_index.valid_currencies
+
+        self.exchange_rates = exchange_rates
+        self.rates_time = rates_time
+
+    def check_currency(self, currency: str, allow_auto_detect=False):
+        if allow_auto_detect and currency == AUTO_DETECT:
+            return
+
+        if currency not in self.valid_currencies:
+            raise ValueError(f"{currency} was not found in valid_currencies.txt.")
+
+    def get_symbol_condition(self, currency_from: str) -> dict:
+        if currency_from != AUTO_DETECT:
+            return self.currency_index.symbol_conditions[currency_from]
+
+        # Symbols of every currency, built on first use
+        if self.detection_symbol_condition is None:
+            for symbol, currency in self.symbol_defaults.items():
+                self.check_currency(currency)
+            self.detection_symbol_condition = self.currency_index.get_detection_symbol_condition(self.symbol_defaults)
+
+        return self.detection_symbol_condition
+
+    @property
+    def currency_converter(self) -> CurrencyConverter:
+        if self.rates_time is not None:
+            return self.currency_converter_at(self.rates_time)
+
+        # ExchangeRates.get_rates() only reloads the rates once they have expired
+        with PROFILER.stage("rate_loading"):
+            return CurrencyConverter(self.exchange_rates.get_rates())
+
+    def currency_converter_at(self, timestamp: float) -> CurrencyConverter:
+        """
+        Returns a CurrencyConverter with the exchange rates that were in effect at `timestamp` (Unix time).
+
+        Raises ValueError if no rates from before `timestamp` are in the rate history.
+        """
+        if getattr(self.exchange_rates, "history", None) is None:
+            raise ValueError("The exchange rates have no rate history.")
+
+        with PROFILER.stage("rate_loading"):
+            return CurrencyConverter(self.exchange_rates.get_rates_at(timestamp))
+
+    def get_price_matcher(self, currency_from: str) -> PriceMatcher:
+        # The PriceMatcher of each currency is built once and shared between texts
+        return get_price_matcher(currency_from, self.get_symbol_condition(currency_from), currency_from == AUTO_DETECT, self.matcher_options)
+
+    def find_prices(self, text: str, currency_from: str, currency_to=None) -> list:
+        """
+        Returns the prices in `text` found by PriceMatcher. Prices that are already in `currency_to` are left out.
+        """
+        matcher = self.get_price_matcher(currency_from)
+        if self.segment_cache is not None:
+            prices = self.segment_cache.find_prices(text, matcher, self.matcher_options)
+        else:
+            prices = matcher.find_prices(text)
+        return [price for price in prices if price['currency'] != currency_to]
+
+    def convert_text(self, text: str, currency_from: str, currency_to: str, currency_converter=None) -> tuple:
+        """
+        Converts the prices in `text` from `currency_from` to `currency_to`.
+
+        Returns the converted text, the prices found by PriceParser and the converted amounts.
+        """
+        if currency_converter is None:
+            currency_converter = self.currency_converter
+
+        if self.result_cache is None:
+            prices = self.find_prices(text, currency_from, currency_to)
+            return self.rewrite_prices(text, prices, currency_from, currency_to, currency_converter)
+
+        # A text that was already converted is not parsed again
+        key = ResultCache.make_key(text, currency_from, currency_to, self.cache_options)
+        version = currency_converter.snapshot.version
+        result = self.result_cache.get(key, version)
+        if result is None:
+            prices = self.find_prices(text, currency_from, currency_to)
+            result = self.rewrite_prices(text, prices, currency_from, currency_to, currency_converter)
+            self.result_cache.put(key, version, result)
+
+        return result
+
+    def convert_to_many(self, text: str, currency_from: str, currencies_to: list, currency_converter=None) -> dict:
+        """
+        Converts the prices in `text` from `currency_from` to each currency in `currencies_to`.
+
+        The prices are found and parsed once. Only the conversion, formatting and rewriting
+        are repeated for each currency, and every currency uses the same exchange rates.
+
+        Returns a dictionary that maps each currency in `currencies_to` to the result of
+        `convert_text` for that currency.
+        """
+        if currency_converter is None:
+            currency_converter = self.currency_converter
+
+        all_prices = self.find_prices(text, currency_from)
+
+        results = {}
+        for currency_to in currencies_to:
+            prices = [price for price in all_prices if price['currency'] != currency_to]
+            results[currency_to] = self.rewrite_prices(text, prices, currency_from, currency_to, currency_converter)
+
+        return results
+
+    def rewrite_prices(self, text: str, prices: list, currency_from: str, currency_to: str, currency_converter) -> tuple:
+        """
+        Converts `prices`, which were found in `text`, to `currency_to` and replaces them in `text`.
+
+        Returns the converted text, `prices` and the converted amounts.
+        """
+        places = self.currency_data[currency_to]["ISOdigits"]
+        converted_values = convert_prices(prices, currency_converter, currency_from, currency_to, places, self.rounding)
+
+        new_symbols = self.currency_index.target_symbols[currency_to]
+        with PROFILER.stage("rewrite"):
+            replacements = build_replacements(prices, converted_values, new_symbols)
+            text = rewrite_text(text, replacements)
+
+        return text, prices, converted_values
+
+    def convert(self, text: str, currency_from: str, currency_to: str) -> str:
+        return self.convert_text(text, currency_from, currency_to)[0]
+
+    def convert_many(self, texts, currency_from: str, currency_to: str, workers=1, currency_converter=None) -> list:
+        """
+        Converts every text in `texts` and returns the converted texts in the same order.
+
+        If `workers` is greater than 1, the texts are converted by a pool of `workers` processes.
+        Every text is converted with the same exchange rates, even if they are updated meanwhile.
+        """
+        if currency_converter is None:
+            currency_converter = self.currency_converter
+        if workers <= 1:
+            return [self.convert_text(text, currency_from, currency_to, currency_converter)[0] for text in texts]
+
+        texts = list(texts)
+        chunksize = max(1, len(texts) // (workers * 4))
+        with self.process_pool(workers, currency_converter) as executor:
+            tasks = ((text, currency_from, currency_to) for text in texts)
+            return list(executor.map(_convert_in_worker, tasks, chunksize=chunksize))
+
+    def convert_file_parallel(self, input_file, output_file, currency_from: str, currency_to: str, workers: int, shard_size=SHARD_SIZE,
+                              currency_converter=None) -> int:
+        """
+        Converts `input_file` with a pool of `workers` processes and writes the result to `output_file`.
+
+        The file is split into shards of whole lines of about `shard_size` characters. A price never
+        spans more than one line, so every shard can be converted on its own. Only a few shards per
+        worker are read ahead, and the shards are written in their original order.
+
+        Returns the number of prices converted.
+        """
+        num_prices = 0
+        with self.process_pool(workers, currency_converter) as executor:
+            pending = deque()
+            for shard in read_shards(input_file, shard_size):
+                pending.append(executor.submit(_convert_in_worker, (shard, currency_from, currency_to), True))
+
+                # Limit how much of the file is held in memory
+                if len(pending) >= workers * 2:
+                    converted, num_found = pending.popleft().result()
+                    with PROFILER.stage("output_write"):
+                        output_file.write(converted)
+                    num_prices += num_found
+
+            while pending:
+                converted, num_found = pending.popleft().result()
+                with PROFILER.stage("output_write"):
+                    output_file.write(converted)
+                num_prices += num_found
+
+        return num_prices
+
+    def iter_mapped_replacements(self, data, start: int, end: int, currency_from: str, currency_to: str, currency_converter=None):
+        """
+        Converts the prices in the UTF-8 encoded `data[start:end]` (e.g. a memory-mapped file)
+        without decoding all of it. `start` must be the start of a line.
+
+        The symbols are found with a bytes scanner. Only the lines that contain a symbol are
+        decoded and converted, since a price never spans more than one line.
+
+        Yields a (line_start, line_end, converted_line, num_prices) tuple for each line with a
+        price, as soon as the line is converted. `converted_line` is the UTF-8 encoded converted
+        text of `data[line_start:line_end]`.
+        """
+        if currency_converter is None:
+            currency_converter = self.currency_converter
+
+        byte_scanner = compile_byte_symbol_scanner(tuple(self.get_symbol_condition(currency_from).keys()))
+        position = start
+        while True:
+            match = byte_scanner.search(data, position, end)
+            if match is None:
+                break
+
+            # Find the line around the symbol. `position` is always the start of a line.
+            newline = data.rfind(b"\n", position, match.start())
+            line_start = newline + 1 if newline != -1 else position
+            newline = data.find(b"\n", match.end(), end)
+            line_end = newline + 1 if newline != -1 else end
+
+            # Bytes that are not valid UTF-8 are kept as they are
+            line = data[line_start:line_end].decode("utf-8", "surrogateescape")
+            prices = self.find_prices(line, currency_from, currency_to)
+            converted, prices, converted_values = self.rewrite_prices(line, prices, currency_from, currency_to, currency_converter)
+            if prices:
+                yield line_start, line_end, converted.encode("utf-8", "surrogateescape"), len(prices)
+
+            position = line_end
+
+    def convert_mapped(self, input_path: str, output_file, currency_from: str, currency_to: str, workers=1, currency_converter=None) -> int:
+        """
+        Converts the file at `input_path` through a read-only memory map and writes the result to
+        `output_file`, which must be opened in binary mode.
+
+        The file is never read into a string. Each converted line is written as soon as it is
+        converted, and unchanged bytes are copied from the map in slices of CHUNK_SIZE bytes, so
+        memory use does not depend on the size of the file. Line endings and invalid UTF-8 are
+        written back unchanged.
+
+        If `workers` is greater than 1, the file is split into ranges of whole lines of about
+        SHARD_SIZE bytes, and each worker maps the same file and returns only the converted lines
+        of its range. Only a few ranges per worker are converted ahead of the output.
+
+        Returns the number of prices converted.
+        """
+        if currency_converter is None:
+            currency_converter = self.currency_converter
+
+        # An empty file cannot be memory-mapped
+        if os.path.getsize(input_path) == 0:
+            return 0
+
+        with open(input_path, "rb") as input_file, mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if workers <= 1:
+                replacements = self.iter_mapped_replacements(data, 0, len(data), currency_from, currency_to, currency_converter)
+                position, num_prices = write_mapped(data, 0, replacements, output_file)
+            else:
+                position = 0
+                num_prices = 0
+                with self.process_pool(workers, currency_converter) as executor:
+                    pending = deque()
+                    for start, end in split_lines(data, max(workers * 4, len(data) // SHARD_SIZE)):
+                        pending.append(executor.submit(_convert_range_in_worker, (input_path, start, end, currency_from, currency_to)))
+
+                        # Limit how many converted lines are held in memory
+                        if len(pending) >= workers * 2:
+                            position, num_found = write_mapped(data, position, pending.popleft().result(), output_file)
+                            num_prices += num_found
+
+                    while pending:
+                        position, num_found = write_mapped(data, position, pending.popleft().result(), output_file)
+                        num_prices += num_found
+
+            with PROFILER.stage("output_write"):
+                write_byte_range(data, position, len(data), output_file)
+
+        return num_prices
+
+    def process_pool(self, workers: int, currency_converter=None) -> "ProcessPoolExecutor":
+        """
+        Returns a pool of `workers` processes. Each process loads the currency data once and
+        uses the exchange rates of `currency_converter` (by default, this converter's current
+        exchange rates), so workers never download rates themselves.
+        """
+        # Imported here because multiprocessing is slow to import and most conversions run in one process
+        from concurrent.futures import ProcessPoolExecutor
+
+        if currency_converter is None:
+            currency_converter = self.currency_converter
+        initargs = (self.currencies_file, self.valid_currencies_file, currency_converter.rate_table, self.symbol_defaults,
+                    self.rounding, self.result_cache)
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+
+    def convert_stream(self, input_file, output_file, currency_from: str, currency_to: str, chunk_size=CHUNK_SIZE, currency_converter=None) -> int:
+        if currency_converter is None:
+            currency_converter = self.currency_converter
+        return convert_stream(input_file, output_file, currency_from, currency_to, self.currency_data.get(currency_from),
+                              self.currency_data[currency_to], currency_converter, chunk_size=chunk_size,
+                              symbol_condition=self.get_symbol_condition(currency_from), whole_words=currency_from == AUTO_DETECT,
+                              rounding=self.rounding)
+
+
+# Converter used by each worker process. Set by `_init_worker`.
+_worker_converter = None
+_worker_currency_converter = None
+
+
+def _init_worker(currencies_file, valid_currencies_file, rate_table, symbol_defaults, rounding, result_cache):
+    global _worker_converter, _worker_currency_converter
+    _worker_converter = TextCurrencyConverter(currencies_file, valid_currencies_file, symbol_defaults=symbol_defaults, rounding=rounding,
+                                              result_cache=result_cache)
+    _worker_currency_converter = CurrencyConverter(rate_table)
+
+
+def _convert_in_worker(task, return_num_prices=False):
+    text, currency_from, currency_to = task
+    converted, prices, converted_values = _worker_converter.convert_text(text, currency_from, currency_to, _worker_currency_converter)
+    if return_num_prices:
+        return converted, len(prices)
+
+    return converted
+
+
+def _convert_range_in_worker(task):
+    input_path, start, end, currency_from, currency_to = task
+    with open(input_path, "rb") as input_file, mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return list(_worker_converter.iter_mapped_replacements(data, start, end, currency_from, currency_to, _worker_currency_converter))
+
+
+def split_lines(data, num_ranges: int) -> list:
+    """
+    Splits `data` into about `num_ranges` (start, end) ranges of whole lines.
+    """
+    ranges = []
+    start = 0
+    for i in range(1, num_ranges):
+        # End each range after the first newline past its share of the data
+        newline = data.find(b"\n", max(start, len(data) * i // num_ranges))
+        if newline == -1:
+            break
+
+        ranges.append((start, newline + 1))
+        start = newline + 1
+
+    if start < len(data):
+        ranges.append((start, len(data)))
+
+    return ranges
+
+
+def write_byte_range(data, start: int, end: int, output_file):
+    # Copy in slices so that a large range is never held in memory at once
+    for i in range(start, end, CHUNK_SIZE):
+        output_file.write(data[i:min(i + CHUNK_SIZE, end)])
+
+
+def write_mapped(data, position: int, replacements, output_file) -> tuple:
+    """
+    Writes `data` from `position` up to the last replacement, with each (start, end, new_bytes, num_prices)
+    replacement written instead of `data[start:end]`. `replacements` can be a generator, so each
+    replacement is written as soon as it is made.
+
+    Returns the position written up to and the number of prices in the replacements.
+    """
+    num_prices = 0
+    for start, end, new_bytes, num_found in replacements:
+        with PROFILER.stage("output_write"):
+            write_byte_range(data, position, start, output_file)
+            output_file.write(new_bytes)
+        position = end
+        num_prices += num_found
+
+    return position, num_prices
+
+
+def read_shards(input_file, shard_size=SHARD_SIZE):
+    """
+    Yields the text of `input_file` in shards of whole lines of about `shard_size` characters.
+    """
+    lines = []
+    size = 0
+    for line in input_file:
+        lines.append(line)
+        size += len(line)
+        if size >= shard_size:
+            yield "".join(lines)
+            lines = []
+            size = 0
+
+    if lines:
+        yield "".join(lines)
+
+
+def read_batch(source: str):
+    """
+    Returns the documents in `source` as a list of (name, text) tuples.
+
+    `source` can be:
+
+    - a directory: every file in the directory is a document.
+    - a newline-delimited JSON file ending in .jsonl or .ndjson, or "-" for standard input: every
+      line is a document. A line is either a JSON string or a JSON object with a "text" key.
+    - a glob pattern such as "descriptions/*.txt": every matching file is a document.
+
+    Raises ValueError if a line of a JSON file is not valid JSON, or is neither a string nor an
+    object whose "text" is a string.
+    """
+    if source == "-" or source.endswith((".jsonl", ".ndjson")):
+        file = sys.stdin if source == "-" else open(source)
+        documents = []
         try:
-            # Only one type of thousands separator is used, so grabbing only the first one will give you
-            # the thousands separator for the number
-            thousands_sep = thousands_separators[0][0]
-        except:
-            thousands_sep = ""
+            for i, line in enumerate(file):
+                if line.strip() == "":
+                    continue
+
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as error:
+                    raise ValueError(f"Line {i + 1} of {source} is not valid JSON: {error}")
+
+                if not isinstance(record, str) and not (isinstance(record, dict) and isinstance(record.get("text"), str)):
+                    raise ValueError(f'Line {i + 1} of {source} must be a JSON string or an object with a "text" string.')
+                documents.append((i, record))
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        return documents
+
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(source, name) for name in os.listdir(source))
+    else:
+        paths = sorted(glob.glob(source))
 
-        price = price.split(decimal_separator)
+    documents = []
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
 
-        # If price was not split into two, it means that the result did not have a decimal separator.
-        if len(price) == 1:
-            # Force price to have a decimal separator and split it
-            decimal_separator = "."
-            price = price[0].split(decimal_separator)
+        with open(path) as file:
+            documents.append((path, file.read()))
 
-        uses_indian_thousands_system = result["value"]["uses_indian_thousands_system"]
-        num = str(price[0] + decimal_separator + price[1])
-        new_price = format_number(num=num, thousands_separator=thousands_sep, uses_indian_thousands_system=uses_indian_thousands_system)
-        converted_values.append(new_price)
+    return documents
+
+
+def parse_date(date: str) -> float:
+    """
+    Returns the Unix time of `date`, which is a Unix time, a date such as "2024-03-05" or a
+    date and time such as "2024-03-05T14:30:00". Times without a time zone are in UTC.
+
+    A date without a time stands for the end of that day, so the last rates published on that date are used.
+
+    Example:
+    >>> parse_date("2024-03-05")
+    1709683199.0
+    """
+    try:
+        return float(date)
+    except ValueError:
+        pass
+
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=UTC)
+    except ValueError:
+        pass
+    else:
+        return (day + timedelta(days=1, seconds=-1)).timestamp()
+
+    try:
+        time = datetime.fromisoformat(date)
+    except ValueError:
+        raise ValueError(f"{date} is not a date. Please enter a date such as 2024-03-05, 2024-03-05T14:30:00 or a Unix time.")
+
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=UTC)
+    return time.timestamp()
+
+
+def main(text, currency_from, currency_to, output_file, converter=None):
+    if converter is None:
+        converter = TextCurrencyConverter()
+
+    # Get current exchange rates
+    print("Updating exchange rates...")
+    currency_converter = converter.currency_converter
+    print(f"Using exchange rates from {currency_converter.snapshot.last_update} (snapshot {currency_converter.snapshot.version}).")
+
+    # Find all prices in text that use currency_from and convert them
+    print(f"Finding prices and converting currencies from {currency_from} to {currency_to}...")
+    text, prices, converted_values = converter.convert_text(text, currency_from, currency_to, currency_converter)
 
     print(f"\tOriginal ({currency_from})\t\tConverted amount ({currency_to})")
     for i, value in enumerate(converted_values):
-        print(f"\t{price_parser.prices[i]['amount']}\t\t{value}")
+        print(f"\t{prices[i]['amount']} {prices[i]['currency']}\t\t{value}")
 
     # Write to file
     print(f"Writing changes to {output_file}...")
+    print(text)
 
-    # Create price parser for currency_to so that the currency's symbols are retrieved
-    curr_to_data = data[currency_to]
+    with PROFILER.stage("output_write"), open(output_file, "w") as file:
+        file.write(text)
 
-    # Get name and plural name of currency_to
-    name = curr_to_data["name"].replace(curr_to_data["demonym"], "") # Remove demonym from currency
-    plural_name = name.replace(curr_to_data["majorSingle"], curr_to_data["majorPlural"])
 
-    for i, prices in enumerate(price_parser.prices):
-        # Replace monetary amounts        
-        text = text.replace(prices['amount'], converted_values[i])
+def get_output_path(output_file: str, currency_to: str) -> str:
+    """
+    Returns the path that the text converted to `currency_to` is written to when converting to many currencies.
 
-        # Replace currency symbol
-        old_curr = prices['symbol']
-        new_curr = None
+    Example:
+    >>> get_output_path("output.txt", "EUR")
+    'output.EUR.txt'
+    """
+    root, extension = os.path.splitext(output_file)
+    return f"{root}.{currency_to}{extension}"
 
-        if prices['symbol_type'] == 'ISO':
-            new_curr = currency_to
-        elif prices['symbol_type'] == "symbol":
-            new_curr = curr_to_data["symbol"]
-        elif prices['symbol_type'] == "symbol_native":
-            new_curr = curr_to_data["symbolNative"]
-        elif prices['symbol_type'] == "denonym_name":
-            new_curr = curr_to_data['name']
-        elif prices['symbol_type'] == "name":
-            new_curr = name
-        elif prices['symbol_type'] == 'plural_name':
-            new_curr = plural_name
 
-        text = text.replace(prices['symbol'], new_curr)
+def fan_out_main(text, currency_from, currencies_to, output_file, converter=None):
+    if converter is None:
+        converter = TextCurrencyConverter()
 
-    print(text)
+    print("Updating exchange rates...")
+    currency_converter = converter.currency_converter
+    print(f"Using exchange rates from {currency_converter.snapshot.last_update} (snapshot {currency_converter.snapshot.version}).")
 
-    with open(output_file, "w") as file:
-        file.write(text)
+    print(f"Finding prices and converting currencies from {currency_from} to {', '.join(currencies_to)}...")
+    results = converter.convert_to_many(text, currency_from, currencies_to, currency_converter)
+
+    for currency_to, (converted, prices, converted_values) in results.items():
+        path = get_output_path(output_file, currency_to)
+        print(f"\tConverted {len(prices)} prices to {currency_to}. Writing changes to {path}...")
+
+        with PROFILER.stage("output_write"), open(path, "w") as file:
+            file.write(converted)
+
+
+def stream_main(input_path, currency_from, currency_to, output_file, chunk_size=CHUNK_SIZE, converter=None, workers=1, use_mmap=False):
+    if converter is None:
+        converter = TextCurrencyConverter()
+
+    currency_converter = converter.currency_converter
+    print(f"Using exchange rates from {currency_converter.snapshot.last_update} (snapshot {currency_converter.snapshot.version}).")
+
+    print(f"Converting {input_path} from {currency_from} to {currency_to} and writing to {output_file}...")
+    if use_mmap:
+        with open(output_file, "wb") as output:
+            num_prices = converter.convert_mapped(input_path, output, currency_from, currency_to, workers, currency_converter=currency_converter)
+        print(f"\tConverted {num_prices} prices.")
+        return
+
+    with open(input_path) as input_file, open(output_file, "w") as output:
+        if workers > 1:
+            num_prices = converter.convert_file_parallel(input_file, output, currency_from, currency_to, workers,
+                                                         currency_converter=currency_converter)
+        else:
+            num_prices = converter.convert_stream(input_file, output, currency_from, currency_to, chunk_size=chunk_size,
+                                                  currency_converter=currency_converter)
+    print(f"\tConverted {num_prices} prices.")
+
+
+def format_main(input_path, input_format, currency_from, currency_to, output_file, converter=None, columns=None, amount_columns=None):
+    # Deferred so that converting plain text does not import the CSV and HTML readers
+    from input_formats import FORMATS
+
+    if converter is None:
+        converter = TextCurrencyConverter()
+
+    currency_converter = converter.currency_converter
+    print(f"Using exchange rates from {currency_converter.snapshot.last_update} (snapshot {currency_converter.snapshot.version}).")
+
+    options = {}
+    if columns is not None:
+        options["columns"] = columns
+    if amount_columns is not None:
+        options["amount_columns"] = amount_columns
+
+    print(f"Converting {input_path} as {input_format.upper()} from {currency_from} to {currency_to} and writing to {output_file}...")
+    with open(input_path, newline="") as input_file, open(output_file, "w", newline="") as output:
+        num_prices = FORMATS[input_format](input_file, output, converter, currency_from, currency_to, currency_converter, **options)
+    print(f"\tConverted {num_prices} prices.")
+
+
+def batch_main(source, currency_from, currency_to, output_file, output_dir, converter=None, workers=1):
+    if converter is None:
+        converter = TextCurrencyConverter()
+
+    documents = read_batch(source)
+    is_json = source == "-" or source.endswith((".jsonl", ".ndjson"))
+
+    # Documents from a JSON stream are either strings or objects with a "text" key
+    texts = []
+    for name, document in documents:
+        texts.append(document["text"] if is_json and isinstance(document, dict) else document)
+
+    # Every document is converted with the same exchange rates
+    currency_converter = converter.currency_converter
+    print(f"Using exchange rates from {currency_converter.snapshot.last_update} (snapshot {currency_converter.snapshot.version}).")
+
+    print(f"Converting {len(texts)} documents from {currency_from} to {currency_to}...")
+    converted_texts = converter.convert_many(texts, currency_from, currency_to, workers=workers, currency_converter=currency_converter)
+
+    if is_json:
+        print(f"Writing changes to {output_file}...")
+        with PROFILER.stage("output_write"), open(output_file, "w") as file:
+            for (name, document), converted in zip(documents, converted_texts):
+                if isinstance(document, dict):
+                    # Record which exchange rates were used so that the conversion can be reproduced
+                    document = {**document, "text": converted, "rates_time_last_update_unix": currency_converter.snapshot.version}
+                else:
+                    document = converted
+                file.write(json.dumps(document, ensure_ascii=False) + "\n")
+    else:
+        print(f"Writing changes to {output_dir}...")
+        os.makedirs(output_dir, exist_ok=True)
+        for (path, document), converted in zip(documents, converted_texts):
+            with PROFILER.stage("output_write"), open(os.path.join(output_dir, os.path.basename(path)), "w") as file:
+                file.write(converted)
 
 
 if __name__ == '__main__':
@@ -229,46 +1056,179 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--file',
                         required=False,
                         help='File containing the message you would like to convert.')
+    parser.add_argument('-d', '--batch',
+                        required=False,
+                        help='Directory, glob pattern (e.g. "docs/*.txt") or newline-delimited JSON file (.jsonl, or - for standard input) containing many documents to convert.')
     parser.add_argument('-o', '--output_file',
                         required=False,
                         default='output.txt',
                         help='Name of output file. Default: output.txt')
+    parser.add_argument('--output_dir',
+                        required=False,
+                        default='converted',
+                        help='Directory that converted documents are written to with --batch. Default: converted')
     parser.add_argument('-a', '--currency_from',
                         required=True,
-                        help='Currency you would like to convert from. Currency must conform to ISO 4217 standard.')
+                        help=f'Currency you would like to convert from. Currency must conform to ISO 4217 standard. Use {AUTO_DETECT} to convert the prices of every currency.')
     parser.add_argument('-b', '--currency_to',
                         required=True,
-                        help='Currency you would like to convert to. Currency must conform to ISO 4217 standard.')
+                        help='Currency you would like to convert to. Currency must conform to ISO 4217 standard. Separate many currencies with commas (e.g. EUR,GBP,JPY) to write one output file per currency with --text or --file.')
+    parser.add_argument('--format',
+                        choices=['text', 'csv', 'json', 'html'],
+                        default='text',
+                        help='Format of --file. With csv, json or html, only the text in cells, string values or text nodes is converted, and the structure of the file is kept. Default: text')
+    parser.add_argument('--columns',
+                        help='With --format csv, comma-separated names of the columns to search for prices. Default: every column. With --format json, only the string values of these keys are converted.')
+    parser.add_argument('--amount_columns',
+                        help='With --format csv, comma-separated names of columns that only contain amounts in --currency_from (e.g. "1,299.00"). These columns are converted without searching for currency symbols.')
+    parser.add_argument('-s', '--stream',
+                        action='store_true',
+                        help='Read --file in chunks and write the converted text to --output_file as it is converted. Use this for very large files.')
+    parser.add_argument('-m', '--mmap',
+                        action='store_true',
+                        help='Memory-map --file instead of reading it, and only decode the lines that contain a currency symbol. Use this for files of many gigabytes.')
+    parser.add_argument('--chunk_size',
+                        type=int,
+                        default=CHUNK_SIZE,
+                        help=f'Number of characters read at a time with --stream. Default: {CHUNK_SIZE}')
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        help='Number of processes used to convert --batch documents or a large --file. Default: 1')
+    parser.add_argument('--symbol_default',
+                        action='append',
+                        default=[],
+                        metavar='SYMBOL=CURRENCY',
+                        help=f'With -a {AUTO_DETECT}, the currency that an ambiguous symbol stands for, e.g. --symbol_default "$=CAD". Can be used more than once.')
+    parser.add_argument('--rounding',
+                        choices=ROUNDING_MODES.keys(),
+                        default='down',
+                        help='How converted prices are rounded to the decimal places of --currency_to. Default: down')
+    parser.add_argument('--date',
+                        help='Convert with the exchange rates that were in effect on this date (e.g. 2024-03-05, 2024-03-05T14:30:00 or a Unix time) instead of the latest rates. Rates are read from exchange_rates.history, which every downloaded set of rates is added to.')
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='Remember converted texts in memory, so identical documents in a --batch are only converted once.')
+    parser.add_argument('--cache_dir',
+                        help='Also store converted texts in this directory, so they are reused by later runs. Implies --cache.')
+    parser.add_argument('--cache_max_size',
+                        type=int,
+                        default=DISK_SIZE // (1024 * 1024),
+                        help=f'Largest size of --cache_dir in megabytes. Default: {DISK_SIZE // (1024 * 1024)}')
+    parser.add_argument('--incremental',
+                        metavar='PATH',
+                        help='Remember the prices found in each line of the text in PATH, so that when an edited text is converted again, only the lines that changed are searched for prices.')
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const='-',
+                        metavar='PATH',
+                        help='Print the time spent in each stage and counts of the prices found, or write them as JSON to PATH. With --workers, only the work done by the main process is timed.')
 
     args = parser.parse_args()
     args.currency_from = args.currency_from.upper()
     args.currency_to = args.currency_to.upper()
+    # Each currency is converted to once, in the order it was given
+    currencies_to = list(dict.fromkeys(currency.strip() for currency in args.currency_to.split(",") if currency.strip() != ""))
+    if len(currencies_to) == 0:
+        raise ValueError("Please enter a currency to convert to (-b EUR) or a list of currencies (-b EUR,GBP,JPY).")
+
+    # With more than one currency, one output file is written per currency
+    fan_out = len(currencies_to) > 1
+    args.currency_to = currencies_to[0]
+
+    if args.profile != None:
+        PROFILER.enable()
 
-    # Raise error if user enters BOTH args.text and args.file or NEITHER args.text nor args.file
-    if args.text != None and args.file != None:
-        raise ValueError("Cannot enter text and file at the same time. Please split your command into two separate commands.")
-    elif args.text == None and args.file == None:
-        raise ValueError("Please enter text (-t \"sample text here\") or a file (-f file.txt) you would like to convert to.")
+    symbol_defaults = {}
+    for symbol_default in args.symbol_default:
+        symbol, separator, currency = symbol_default.rpartition("=")
+        if separator == "" or symbol == "":
+            raise ValueError(f"{symbol_default} must be in the form SYMBOL=CURRENCY.")
+        symbol_defaults[symbol] = currency.upper()
+
+    # Raise error if user enters more than one of args.text, args.file and args.batch, or none of them
+    num_inputs = sum(arg != None for arg in [args.text, args.file, args.batch])
+    if num_inputs > 1:
+        raise ValueError("Cannot enter text, a file or a batch at the same time. Please split your command into separate commands.")
+    elif num_inputs == 0:
+        raise ValueError("Please enter text (-t \"sample text here\"), a file (-f file.txt) or a batch (-d folder/) you would like to convert to.")
+    elif (args.stream or args.mmap) and args.file == None:
+        raise ValueError("--stream and --mmap can only be used with a file (-f file.txt).")
+    elif fan_out and (args.batch != None or args.stream or args.mmap or args.workers > 1):
+        raise ValueError("Converting to more than one currency can only be done with text (-t) or a file (-f) without --stream, --mmap or --workers.")
+    elif args.format != 'text' and (args.file == None or args.stream or args.mmap or args.workers > 1 or fan_out):
+        raise ValueError("--format can only be used with a file (-f file.csv) converted to one currency without --stream, --mmap or --workers.")
+    elif args.columns != None and args.format not in ['csv', 'json']:
+        raise ValueError("--columns can only be used with --format csv or --format json.")
+    elif args.amount_columns != None and args.format != 'csv':
+        raise ValueError("--amount_columns can only be used with --format csv.")
+    elif args.incremental != None and (args.stream or args.mmap or args.workers > 1):
+        raise ValueError("--incremental cannot be used with --stream, --mmap or --workers.")
 
     # Assign text based on argument not inputted by user
     text = None
-    if args.text == None:
+    if args.text != None:
+        text = args.text
+    elif args.file != None and not args.stream and not args.mmap and args.workers <= 1 and args.format == 'text':
         with open(args.file) as file:
             text = file.read()
-    elif args.file == None:
-        text = args.text
+
+    result_cache = None
+    if args.cache or args.cache_dir != None:
+        result_cache = ResultCache(directory=args.cache_dir, disk_size=args.cache_max_size * 1024 * 1024)
+
+    segment_cache = None
+    if args.incremental != None:
+        segment_cache = SegmentCache.load(args.incremental)
+
+    rates_time = None if args.date == None else parse_date(args.date)
 
     # Check if currency is in valid_currencies.txt
-    with open('valid_currencies.txt') as file:
-        valid_currencies = file.read().splitlines() 
-    if args.currency_from not in valid_currencies:
-        raise ValueError(f"{args.currency_from} was not found in valid_currencies.txt.")
-    if args.currency_to not in valid_currencies:
-        raise ValueError(f"{args.currency_to} was not found in valid_currencies.txt.")
-
-    if args.currency_from == args.currency_to:
+    converter = TextCurrencyConverter(symbol_defaults=symbol_defaults, rounding=ROUNDING_MODES[args.rounding], result_cache=result_cache,
+                                      segment_cache=segment_cache, rates_time=rates_time)
+    converter.check_currency(args.currency_from, allow_auto_detect=True)
+    for currency_to in currencies_to:
+        converter.check_currency(currency_to)
+
+    if fan_out:
+        if args.currency_from in currencies_to:
+            print(f"Input currency {args.currency_from} is also an output currency. Conversion to {args.currency_from} was not performed.")
+            currencies_to = [currency_to for currency_to in currencies_to if currency_to != args.currency_from]
+    elif args.currency_from == args.currency_to:
         print(f"Input currency is the same as output currency. Input: {args.currency_from}. Output: {args.currency_to}.")
         print("Conversion was not performed.")
         quit()
 
-    main(text, args.currency_from, args.currency_to, args.output_file)
+    if fan_out:
+        fan_out_main(text, args.currency_from, currencies_to, args.output_file, converter=converter)
+    elif args.format != 'text':
+        columns = None if args.columns == None else [column.strip() for column in args.columns.split(",")]
+        amount_columns = None if args.amount_columns == None else [column.strip() for column in args.amount_columns.split(",")]
+        format_main(args.file, args.format, args.currency_from, args.currency_to, args.output_file, converter=converter,
+                    columns=columns, amount_columns=amount_columns)
+    elif args.batch != None:
+        batch_main(args.batch, args.currency_from, args.currency_to, args.output_file, args.output_dir, converter=converter, workers=args.workers)
+    elif args.stream or args.mmap or (args.file != None and args.workers > 1):
+        stream_main(args.file, args.currency_from, args.currency_to, args.output_file, chunk_size=args.chunk_size, converter=converter,
+                    workers=args.workers, use_mmap=args.mmap)
+    else:
+        main(text, args.currency_from, args.currency_to, args.output_file, converter=converter)
+
+    if result_cache is not None and args.workers > 1 and (args.batch != None or args.file != None):
+        # Each worker process counts the hits and misses of its own copy of the cache
+        print("Result cache: hits and misses are not counted with --workers.")
+    elif result_cache is not None:
+        stats = result_cache.stats()
+        print(f"Result cache: {stats['hits']} hits ({stats['memory_hits']} in memory, {stats['disk_hits']} on disk), {stats['misses']} misses.")
+
+    if segment_cache is not None:
+        stats = segment_cache.stats()
+        print(f"Incremental: {stats['hits']} unchanged lines reused, {stats['misses']} lines searched for prices.")
+        print(f"Saving the prices of {stats['segments']} lines to {args.incremental}...")
+        segment_cache.save(args.incremental)
+
+    if args.profile == '-':
+        PROFILER.print_report()
+    elif args.profile != None:
+        print(f"Writing profile to {args.profile}...")
+        PROFILER.write_report(args.profile)
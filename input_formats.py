@@ -0,0 +1,292 @@
+import csv
+import json
+import re
+from itertools import chain
+from json.decoder import scanstring
+
+from currency_text_converter import AUTO_DETECT, CHUNK_SIZE, convert_prices
+from number_parser import parse_number
+
+# Number of CSV rows whose amount columns are converted together
+CSV_BATCH_ROWS = 10000
+
+# Characters of a JSON document that start a string or change the structure. Numbers, true,
+# false, null and whitespace never contain them, so everything between two matches is copied as it is.
+JSON_TOKEN = re.compile(r'["{}\[\]:,]')
+
+# Markup whose content is never converted: comments and script and style elements
+HTML_RAW_TEXT = re.compile(r"<!--.*?-->|<(script|style)\b.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+HTML_RAW_TEXT_START = re.compile(r"<(?:!--|script\b|style\b)", re.IGNORECASE)
+
+# Any other tag, including its attributes
+HTML_TAG = re.compile(r"<[!/?a-zA-Z][^>]*>")
+HTML_TAG_START = re.compile(r"<[!/?a-zA-Z]")
+
+
+def convert_string(text: str, converter, scanner, currency_from: str, currency_to: str, currency_converter) -> tuple:
+    """
+    Converts the prices in `text` and returns the converted text and the number of prices converted.
+
+    Most cells, values and text nodes have no currency symbol, so `text` is only converted if
+    `scanner` (the symbol scanner of `currency_from`'s PriceMatcher) finds a symbol in it.
+    """
+    if scanner.search(text) is None:
+        return text, 0
+
+    text, prices, converted_values = converter.convert_text(text, currency_from, currency_to, currency_converter)
+    return text, len(prices)
+
+
+def convert_csv(input_file, output_file, converter, currency_from: str, currency_to: str, currency_converter=None,
+                columns=None, amount_columns=None) -> int:
+    """
+    Converts the prices in a CSV file row by row and returns the number of prices converted.
+
+    The first row is the header and is copied unchanged. Cells of `columns` (a list of column
+    names, or every column by default) are searched for prices like any other text. Cells of
+    `amount_columns` hold bare amounts in `currency_from` (e.g. "1,299.00"), so they are not
+    searched. Instead, the amounts of CSV_BATCH_ROWS rows are parsed and converted in one call.
+
+    | Column type      | Example cell         | Converted cell (USD to EUR)  |
+    | ---------------- | -------------------- | ---------------------------- |
+    | columns          | "Was $20, now $15"   | "Was €18.40, now €13.80"     |
+    | amount_columns   | "1,299.00"           | "1,195.08"                   |
+
+    Cells of amount columns that are not valid amounts (e.g. empty cells) are copied unchanged.
+    Raises ValueError if a column is not in the header, or if `amount_columns` are given with
+    `currency_from` set to AUTO.
+    """
+    if currency_converter is None:
+        currency_converter = converter.currency_converter
+
+    if amount_columns and currency_from == AUTO_DETECT:
+        raise ValueError(f"Amount columns have no currency symbol. Please enter the currency they use instead of {AUTO_DETECT}.")
+
+    # Write rows with the same line endings as the input
+    first_line = input_file.readline()
+    reader = csv.reader(chain([first_line], input_file))
+    writer = csv.writer(output_file, lineterminator="\r\n" if first_line.endswith("\r\n") else "\n")
+
+    header = next(reader, None)
+    if header is None:
+        return 0
+    writer.writerow(header)
+
+    amount_indices = get_column_indices(header, amount_columns or [])
+    if columns is None:
+        text_indices = [i for i in range(len(header)) if i not in amount_indices]
+    else:
+        text_indices = get_column_indices(header, columns)
+
+    scanner = converter.get_price_matcher(currency_from).scanner
+    num_prices = 0
+    rows = []
+    for row in reader:
+        for i in text_indices:
+            if i < len(row):
+                row[i], cell_prices = convert_string(row[i], converter, scanner, currency_from, currency_to, currency_converter)
+                num_prices += cell_prices
+
+        rows.append(row)
+        if len(rows) == CSV_BATCH_ROWS:
+            num_prices += convert_amount_columns(rows, amount_indices, converter, currency_from, currency_to, currency_converter)
+            writer.writerows(rows)
+            rows = []
+
+    num_prices += convert_amount_columns(rows, amount_indices, converter, currency_from, currency_to, currency_converter)
+    writer.writerows(rows)
+    return num_prices
+
+
+def get_column_indices(header: list, columns: list) -> list:
+    indices = []
+    for column in columns:
+        if column not in header:
+            raise ValueError(f"Column {column} not found. Columns: {header}")
+        indices.append(header.index(column))
+
+    return indices
+
+
+def convert_amount_columns(rows: list, amount_indices: list, converter, currency_from: str, currency_to: str, currency_converter) -> int:
+    """
+    Replaces the amounts in the `amount_indices` columns of `rows` with the converted amounts and
+    returns the number of amounts converted. Every amount is converted in a single call.
+    """
+    cells = []
+    amounts = []
+    for row in rows:
+        for i in amount_indices:
+            if i >= len(row):
+                continue
+
+            try:
+                value = parse_number(row[i].strip())
+            except (ValueError, IndexError):
+                continue
+
+            cells.append((row, i))
+            amounts.append({'value': value})
+
+    if len(amounts) == 0:
+        return 0
+
+    places = converter.currency_data[currency_to]["ISOdigits"]
+    converted_values = convert_prices(amounts, currency_converter, currency_from, currency_to, places, converter.rounding)
+    for (row, i), value in zip(cells, converted_values):
+        row[i] = value
+
+    return len(amounts)
+
+
+def convert_json(input_file, output_file, converter, currency_from: str, currency_to: str, currency_converter=None, columns=None) -> int:
+    """
+    Converts the prices in the string values of a JSON document and returns the number of prices converted.
+
+    Only string values with a price are rewritten. Every other byte of the document, including
+    keys, numbers (e.g. 19.90 or 1e400), whitespace and indentation, is copied unchanged. If
+    `columns` (a list of keys) is given, only strings stored under those keys are converted,
+    including strings in lists and objects stored under them.
+
+    Raises ValueError if the document is not valid JSON.
+    """
+    if currency_converter is None:
+        currency_converter = converter.currency_converter
+
+    text = input_file.read()
+
+    # The document is scanned token by token below, which assumes that it is valid JSON
+    json.loads(text)
+
+    keys = None if columns is None else set(columns)
+    scanner = converter.get_price_matcher(currency_from).scanner
+    num_prices = 0
+
+    # One [is_object, selected, expecting_key, value_selected] list per open object or array
+    stack = []
+    position = 0
+    while True:
+        match = JSON_TOKEN.search(text, position)
+        if match is None:
+            output_file.write(text[position:])
+            break
+
+        output_file.write(text[position:match.start()])
+        char = match.group()
+        position = match.end()
+        frame = stack[-1] if stack else None
+
+        if frame is not None and frame[0] and frame[2]:
+            # A key is copied unchanged, and decides whether its value is converted
+            if char == '"':
+                key, position = scanstring(text, position)
+                frame[3] = frame[1] or key in keys
+                output_file.write(text[match.start():position])
+                continue
+        elif char == '"' or char in "{[":
+            if frame is None:
+                selected = keys is None
+            else:
+                selected = frame[3] if frame[0] else frame[1]
+
+            if char == '"':
+                value, position = scanstring(text, position)
+                converted, value_prices = value, 0
+                if selected:
+                    converted, value_prices = convert_string(value, converter, scanner, currency_from, currency_to, currency_converter)
+
+                if value_prices == 0:
+                    output_file.write(text[match.start():position])
+                else:
+                    output_file.write(json.dumps(converted, ensure_ascii=False))
+                    num_prices += value_prices
+                continue
+
+            stack.append([char == "{", selected, True, False])
+            output_file.write(char)
+            continue
+
+        if char in "}]":
+            stack.pop()
+        elif char == ":":
+            frame[2] = False
+        elif char == "," and frame[0]:
+            frame[2] = True
+        output_file.write(char)
+
+    return num_prices
+
+
+def iter_html(input_file, chunk_size=CHUNK_SIZE):
+    """
+    Reads HTML from `input_file` in chunks of `chunk_size` characters and yields (is_markup, string) pairs.
+
+    Markup is a tag with its attributes, a comment, or a script or style element with its content.
+    Everything between two pieces of markup is one text node. Joining the strings gives back the input.
+    A "<" that does not start a tag (e.g. in "a < b") is part of the text.
+    """
+    buffer = ""
+    final = False
+    while not final:
+        chunk = input_file.read(chunk_size)
+        final = chunk == ""
+        buffer += chunk
+
+        # Start of the current text node and where to look for the next "<"
+        position = 0
+        search = 0
+        while True:
+            start = buffer.find("<", search)
+            if start == -1:
+                break
+
+            is_raw_text = HTML_RAW_TEXT_START.match(buffer, start) is not None
+            match = (HTML_RAW_TEXT if is_raw_text else HTML_TAG).match(buffer, start)
+            if match is None:
+                # The rest of the markup may be in the next chunk
+                if not final and (is_raw_text or HTML_TAG_START.match(buffer, start) or start == len(buffer) - 1):
+                    break
+                search = start + 1
+                continue
+
+            if start > position:
+                yield False, buffer[position:start]
+            yield True, match.group()
+            position = search = match.end()
+
+        buffer = buffer[position:]
+
+    if buffer != "":
+        yield False, buffer
+
+
+def convert_html(input_file, output_file, converter, currency_from: str, currency_to: str, currency_converter=None,
+                 chunk_size=CHUNK_SIZE) -> int:
+    """
+    Converts the prices in the text of an HTML document and returns the number of prices converted.
+
+    The document is read in chunks (see `iter_html`). Only text nodes are searched for prices, so
+    tags, attributes, comments, scripts and styles are copied unchanged. A price split by a tag
+    (e.g. "<b>$</b>5") is not found.
+    """
+    if currency_converter is None:
+        currency_converter = converter.currency_converter
+
+    scanner = converter.get_price_matcher(currency_from).scanner
+    num_prices = 0
+    for is_markup, string in iter_html(input_file, chunk_size):
+        if not is_markup:
+            string, text_prices = convert_string(string, converter, scanner, currency_from, currency_to, currency_converter)
+            num_prices += text_prices
+        output_file.write(string)
+
+    return num_prices
+
+
+# Converters of each format that can be chosen with --format. Each converter reads from an
+# open input file and writes to an open output file.
+FORMATS = {
+    "csv": convert_csv,
+    "json": convert_json,
+    "html": convert_html
+}
@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+
+
+class Stage:
+    '''
+    Times one run of a stage. Returned by `Profiler.stage()` when profiling is enabled.
+    '''
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NoStage:
+    '''
+    Returned by `Profiler.stage()` when profiling is disabled. Does nothing.
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_STAGE = NoStage()
+
+
+class Profiler:
+    '''
+    Collects the time spent in each stage of a conversion and counts events such as the prices
+    found per symbol type or the amounts that were rejected.
+
+    Profiling is disabled by default. While it is disabled, `stage()` returns a shared object
+    that does nothing and `count()` returns immediately, so instrumented code costs about one
+    attribute lookup per stage.
+
+    | Stage               | Time spent                                                      |
+    | ------------------- | --------------------------------------------------------------- |
+    | rate_loading        | Getting the exchange rates and their RateSnapshot               |
+    | rate_refresh        | Downloading and saving new exchange rates                       |
+    | symbol_scan         | Finding currency symbols in a text                              |
+    | number_extraction   | Finding and parsing the amount next to each symbol              |
+    | number_parser_find  | NumberParser.find() for amounts missing from the parse cache    |
+    | conversion          | Converting amounts between currencies                           |
+    | formatting          | Formatting converted amounts                                    |
+    | rewrite             | Building the converted text                                     |
+    | output_write        | Writing converted texts                                         |
+
+    Stages can be nested: number_parser_find is part of number_extraction.
+
+    Example usage:
+
+        PROFILER.enable()
+        converter.convert("It costs $5.", "USD", "EUR")
+        PROFILER.print_report()
+
+    Call `add_hook(callback)` to receive `callback(stage, seconds)` after every timed stage,
+    e.g. to send the timings to a metrics library.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Stage name -> [total seconds, number of runs]
+        self.timings = {}
+        self.counters = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add_hook(self, callback):
+        self.hooks.append(callback)
+
+    def remove_hook(self, callback):
+        self.hooks.remove(callback)
+
+    def stage(self, name: str):
+        """
+        Returns a context manager that times the code in a `with` block as stage `name`.
+        """
+        if not self.enabled:
+            return NO_STAGE
+        return Stage(self, name)
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            timing = self.timings.setdefault(name, [0.0, 0])
+            timing[0] += seconds
+            timing[1] += 1
+
+        for hook in self.hooks:
+            hook(name, seconds)
+
+    def count(self, name: str, n=1):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> dict:
+        stages = {}
+        for name, (total, runs) in self.timings.items():
+            stages[name] = {"total_s": total, "runs": runs, "mean_s": total / runs}
+
+        return {"stages": stages, "counters": dict(sorted(self.counters.items()))}
+
+    def print_report(self):
+        report = self.report()
+
+        print(f"{'Stage':<25}{'Total (s)':>12}{'Runs':>10}{'Mean (s)':>14}")
+        for name, stage in sorted(report["stages"].items(), key=lambda item: item[1]["total_s"], reverse=True):
+            print(f"{name:<25}{stage['total_s']:>12.6f}{stage['runs']:>10}{stage['mean_s']:>14.8f}")
+
+        print(f"\n{'Counter':<40}{'Count':>10}")
+        for name, count in report["counters"].items():
+            print(f"{name:<40}{count:>10}")
+
+    def write_report(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=4)
+
+
+# Profiler used by every instrumented function in this process
+PROFILER = Profiler()
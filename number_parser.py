@@ -1,3 +1,17 @@
+from decimal import Decimal
+from functools import lru_cache
+
+from instrumentation import PROFILER
+
+# Characters allowed in a number string. Shared by every NumberParser instead of being rebuilt per number.
+VALID_DIGITS = frozenset("0123456789")
+SEPARATORS = frozenset([",", ".", "_", " ", "'"])
+DECIMAL_SEPARATORS = frozenset([",", "."])
+
+# Number of distinct number strings remembered by `parse_number`
+PARSE_CACHE_SIZE = 4096
+
+
 class NumberParser:
     """
     Parses numbers in string format and converts them to integer.
@@ -11,20 +25,25 @@ class NumberParser:
     Access the float using self.number and the original number using self.string
 
     Access decimal separator and thousand separator positions using self.decimal_separator_pos and self.thousand_separator_pos
+
+    Use `parse_number()` to parse a string once and reuse the result for repeated strings.
     """
+    __slots__ = ("value", "string", "number", "decimal_separator_pos", "thousands_separator_pos",
+                 "num_decimal_places", "uses_indian_thousands_sys")
+
+    VALID_DIGITS = VALID_DIGITS
+    SEPARATORS = SEPARATORS
+    DECIMAL_SEPARATORS = DECIMAL_SEPARATORS
+
     def __init__(self, number) -> None:
         # self.string will be converted to self.number in NumberParser
         self.value = None
         self.string = number
         self.number = None
 
-        # Create list of strings from 0 to 9
-        self.VALID_DIGITS = [str(i) for i in range(10)]
-
         self.decimal_separator_pos = None
         self.thousands_separator_pos = None
-        self.SEPARATORS = [",", ".", "_", " ", "'"]
-        self.DECIMAL_SEPARATORS = [",", "."]
+        self.num_decimal_places = None
 
         '''
         The Indian numbering system groups the first three digits to the left of the decimal point.
@@ -81,7 +100,9 @@ class NumberParser:
             separator is a thousands separator or a decimal separator.
             '''
 
-            if (self.string[-4] in self.SEPARATORS or len(separators_found) > 1) and use_thousands_separator_for_single_unique_separator:
+            # A number shorter than 4 characters (e.g. "0.5") cannot have a thousands separator 3 digits from its end
+            has_thousands_group = len(self.string) >= 4 and self.string[-4] in self.SEPARATORS
+            if (has_thousands_group or len(separators_found) > 1) and use_thousands_separator_for_single_unique_separator:
                 # Assumes that the separator is a thousands separator
                 thousands_separator = self.string[-4]
                 self.thousands_separator_pos = [(digit, i) for i, digit in enumerate(self.string) if digit in self.SEPARATORS]
@@ -137,4 +158,62 @@ class NumberParser:
                 'thousands': self.thousands_separator_pos
             },
             'uses_indian_thousands_system': self.uses_indian_thousands_sys
-        }
\ No newline at end of file
+        }
+
+
+class ParsedNumber:
+    """
+    The result of parsing a number string with NumberParser.
+
+    - number: the number as a float.
+    - decimal: the exact number as a Decimal.
+    - string: the original number string.
+    - decimal_separator_pos: (separator, position) of the decimal separator, or None.
+    - thousands_separator_pos: tuple of (separator, position) of each thousands separator, or None.
+    - uses_indian_thousands_system: True if the number uses the Indian numbering system.
+
+    ParsedNumbers are shared between all prices with the same number string, so they must not be changed.
+    """
+    __slots__ = ("number", "decimal", "string", "decimal_separator_pos", "thousands_separator_pos", "uses_indian_thousands_system")
+
+    def __init__(self, number, decimal, string, decimal_separator_pos, thousands_separator_pos, uses_indian_thousands_system):
+        self.number = number
+        self.decimal = decimal
+        self.string = string
+        self.decimal_separator_pos = decimal_separator_pos
+        self.thousands_separator_pos = thousands_separator_pos
+        self.uses_indian_thousands_system = uses_indian_thousands_system
+
+    @property
+    def thousands_separator(self) -> str:
+        # Only one type of thousands separator is used, so the first one is the thousands separator for the number
+        return self.thousands_separator_pos[0][0] if self.thousands_separator_pos else ""
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_number(string: str) -> ParsedNumber:
+    """
+    Parses `string` with NumberParser and returns the result as a ParsedNumber.
+
+    Results are cached, so a string that occurs many times in a text (e.g. "9.99") is only parsed once.
+    Raises ValueError (or IndexError) like NumberParser.find() if `string` is not a valid number.
+    """
+    num_parser = NumberParser(string)
+    with PROFILER.stage("number_parser_find"):
+        num_parser.find()
+
+    thousands_separator_pos = num_parser.thousands_separator_pos
+    if thousands_separator_pos is not None:
+        thousands_separator_pos = tuple(thousands_separator_pos)
+
+    # Build the exact value from the digits of the string rather than from the float
+    if num_parser.decimal_separator_pos is not None:
+        position = num_parser.decimal_separator_pos[1]
+        whole_number, decimal = string[:position], string[position+1:]
+    else:
+        whole_number, decimal = string, ""
+    whole_number = "".join(digit for digit in whole_number if digit in VALID_DIGITS)
+    exact = Decimal(whole_number + "." + decimal if decimal else whole_number)
+
+    return ParsedNumber(num_parser.number, exact, string, num_parser.decimal_separator_pos, thousands_separator_pos,
+                        num_parser.uses_indian_thousands_sys)
@@ -1,96 +1,48 @@
 import re
-from number_parser import NumberParser
-import copy
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from number_parser import parse_number
+from instrumentation import PROFILER
 
-from price_parser import Price
+# A number is a run of digits and separators (see `number_parser.SEPARATORS`). Moving forwards,
+# a separator must be followed by a digit. Moving backwards, a separator must be preceded by a digit.
+FORWARD_NUMBER = re.compile(r"(?:\d|[,._ '](?=\d))+")
+BACKWARD_NUMBER = re.compile(r"(?:\d|(?<=\d)[,._ '])+\Z")
 
-class PriceParser:
-    '''
-    Finds all prices associated with `currency_from` in `text`.
-    '''
-
-    def __init__(self, currency_from, currency_data, text):
-        self.currency_from = currency_from
-        self.text = text
+# Number of characters before a symbol that are searched for a number at first
+NUMBER_WINDOW = 64
 
-        # Get name and plural name of currency
-        name = currency_data["name"].replace(currency_data["demonym"], "") # Remove demonym from currency
-        plural_name = name.replace(currency_data["majorSingle"], currency_data["majorPlural"])
-        name = name.strip().upper()
-        plural_name = plural_name.strip().upper()
+# Regex guard that stops a symbol from matching right before a letter. [^\W\d_] matches a letter.
+NOT_BEFORE_LETTER = r"(?![^\W\d_])"
 
-        self.numbers = []
-        self.THOUSANDS_SEPARATORS = [",", ".", "_", " ", "'"]
-        self.DECIMAL_SEPARATORS = [",", "."]
-        self.prices = {}
-        self.found = {}
 
-        # Stores indices of where the currency index occurs
-        self.currency_indices = {}
-
-        self.separator_positions = {}
+class PriceMatcher:
+    '''
+    Finds the prices of one currency (or of every currency, when detecting currencies) in texts.
 
-        """
-        `self.SYMBOL_CONDITION` states when a currency symbol can be used in English.
+    A PriceMatcher holds everything that does not depend on the text: the symbol condition and
+    the compiled symbol scanner. It does not change after it is created, so one PriceMatcher can
+    scan any number of texts, from any number of threads.
 
-        It contains 3 keys:
+    Use `get_price_matcher()` to reuse the PriceMatcher of a currency instead of building it again.
+    '''
+    __slots__ = ("currency_from", "symbol_condition", "whole_words", "scanner")
 
-        - placed_before: currency symbol may be placed before a quantity.
-        - placed_after: currency symbol may be placed after a quantity.
-        - spaces_allowed: currency symbol may have a space between it and the amount.
+    def __init__(self, currency_from, symbol_condition, whole_words=False):
+        self.currency_from = currency_from
 
-        NOTE: for `currency_data['symbol']` and `currency_data['symbolNative']`,
-        some currencies only allow you to place a symbol before or after the amount.
-        However, this common grammatical mistake will be automatically converted.
-        """
+        # States when each currency symbol can be used in English. See `get_symbol_condition`.
+        self.symbol_condition = symbol_condition
 
-        self.SYMBOL_CONDITION = {
-            currency_from: {
-                'placed_before': True,
-                'placed_after': True,
-                'spaces_allowed': "optional",
-                "type" : "ISO"
-            },
-            currency_data['symbol']: {
-                'placed_before': True,
-                'placed_after': True,
-                'spaces_allowed': "optional" if len(currency_data['symbol']) > 1 else "required",
-                "type" : "symbol"
-            },
-            currency_data['symbolNative']: {
-                'placed_before': True,
-                'placed_after': True,
-                'spaces_allowed': "forbidden",
-                "type" : "symbol_native"       
-            },
-            currency_data['name'].upper(): {
-                'placed_before': False,
-                'placed_after': True,
-                'spaces_allowed': "optional",
-                "type": "denonym_name"
-            },
-            name: {
-                'placed_before': False,
-                'placed_after': True,
-                'spaces_allowed': "required",
-                "type" : "name"
-            },
-            plural_name: {
-                'placed_before': False,
-                'placed_after': True,
-                'spaces_allowed': "required",
-                "type" : "plural_name"
-            }
-        }
+        # If True, symbols made of letters (e.g. "USD" or "R") are not matched inside longer words
+        self.whole_words = whole_words
 
-        # self.SYMBOL_TYPE describes the symbol type in SYMBOL_
-        self.SYMBOL_TYPE = [
-            "ISO"
-        ]
+        self.scanner = compile_symbol_scanner(tuple(symbol_condition.keys()), whole_words)
 
-    def find_number(self, move_backwards: bool, symbol_index: int, condition: dict) -> str:
+    def find_number(self, text: str, move_backwards: bool, symbol_index: int, condition: dict) -> tuple:
         """
-        Finds number located next to symbol_index.
+        Finds number located next to symbol_index in `text`.
 
         symbol_index is the location of the currency symbol.
 
@@ -101,155 +53,377 @@ class PriceParser:
         | "$1,000"  |  "1,000"  |
         | "$10.000" |  "10.000" |
 
-        This function works by identifying if the consecutive character is a digit
-        or a valid thousands or decimal separator.
+        A number is a run of digits and thousands or decimal separators, where every separator
+        is followed by a digit (or, when moving backwards, preceded by a digit). If spaces are
+        allowed, one space between the symbol and the number is skipped. If spaces are
+        forbidden, a space next to the symbol means there is no number.
 
-        - If the consecutive character is a valid separator, continue appending to number
-        - If the consecutive character is NOT a valid separator, stop and return the number
-        """
+        The run is matched with the precompiled FORWARD_NUMBER and BACKWARD_NUMBER regexes
+        instead of testing one character at a time.
 
+        Returns the number and its (start, end) offsets in `text`, or (None, None) if no number was found.
+        """
         i = symbol_index
 
-        num = []
-        while i < len(self.text):
-            if move_backwards:
-                char = self.text[i-1]
-            else:
-                char = self.text[i]
+        if move_backwards:
+            if i > 0 and text[i-1] == " ":
+                if condition["spaces_allowed"] == "required" or condition["spaces_allowed"] == "optional":
+                    i -= 1
+                elif condition["spaces_allowed"] == "forbidden":
+                    return None, None
+
+            # Search a window before the symbol. If the number reaches the start of the window, the window is too small.
+            window = NUMBER_WINDOW
+            while True:
+                window_start = max(0, i - window)
+                match = BACKWARD_NUMBER.search(text, window_start, i)
+                if match is None or match.start() > window_start or window_start == 0:
+                    break
+                window *= 2
+        else:
+            if i < len(text) and text[i] == " ":
+                if condition["spaces_allowed"] == "required" or condition["spaces_allowed"] == "optional":
+                    i += 1
+                elif condition["spaces_allowed"] == "forbidden":
+                    return None, None
 
-            try:
-                int(char)
-            except:
-                # If the first character before the currency symbol is a space and spaces are allowed or permitted, move onto the next character
-                if (condition["spaces_allowed"] == "required" or condition["spaces_allowed"] == "optional") and \
-                    abs(symbol_index - i) == 0 and \
-                    char == " ":
-                        if move_backwards:
-                            i -= 1
-                        else:
-                            i += 1
-                        continue
-                elif condition["spaces_allowed"] == "forbidden" and \
-                    abs(symbol_index - i) == 0 and \
-                    char == " ":
-                        break
-                
-                if char in self.THOUSANDS_SEPARATORS:
-                    # Test to see if consecutive character after thousands separator is a number
-                    try:
-                        next_char = self.text[i-2] if move_backwards else self.text[i+1]
-                        int(next_char)
-                    except:
-                        break
-                    else:
-                        num.append(char)
-                        if move_backwards:
-                            i -= 1
-                        else:
-                            i += 1
-                        continue
+            match = FORWARD_NUMBER.match(text, i)
+
+        if match is None:
+            return None, None
+
+        # Remove surrounding whitespace and move the span accordingly
+        num = match.group()
+        start = match.start() + (len(num) - len(num.lstrip()))
+        end = match.end() - (len(num) - len(num.rstrip()))
+        return num.strip(), (start, end)
+
+    def find_symbols(self, text: str) -> list:
+        # Find every symbol in `text` in a single pass. Matches are returned in text order.
+        return [(match.group(), match.start(), match.end()) for match in self.scanner.finditer(text)]
+
+    def find_prices(self, text: str, symbol_matches=None) -> list:
+        """
+        Returns the prices in `text`. Each price is a dictionary with the symbol, the currency,
+        the amount, their offsets in `text` and the parsed amount (see `parse_number`).
+
+        `symbol_matches` are the symbols found by `find_symbols(text)`. By default, `text` is scanned again.
+        """
+        if symbol_matches is None:
+            with PROFILER.stage("symbol_scan"):
+                symbol_matches = self.find_symbols(text)
+
+        with PROFILER.stage("number_extraction"):
+            if not PROFILER.enabled:
+                return self.extract_prices(text, symbol_matches)
+
+            cache_info = parse_number.cache_info()
+            prices = self.extract_prices(text, symbol_matches)
+
+        # Count what was found. This is only done while profiling.
+        new_cache_info = parse_number.cache_info()
+        PROFILER.count("symbols_found", len(symbol_matches))
+        PROFILER.count("prices_found", len(prices))
+        PROFILER.count("parse_cache_hits", new_cache_info.hits - cache_info.hits)
+        PROFILER.count("parse_cache_misses", new_cache_info.misses - cache_info.misses)
+        for price in prices:
+            PROFILER.count(f"prices_found.{price['symbol_type']}")
+
+        return prices
+
+    def extract_prices(self, text: str, symbol_matches: list) -> list:
+        # Returns the prices next to `symbol_matches`. See `find_prices`.
+        prices = []
+
+        # Amounts of the prices found so far. A symbol may label an amount that another symbol
+        # already labels (e.g. "$5 USD"), but may not take part of a different amount.
+        claimed_spans = set()
+        claimed_end = 0
+
+        # Find numbers next to each symbol match
+        for key, start, end in symbol_matches:
+            '''
+            TODO: if a currency symbol is next to two numbers, create a preference for numbers next to symbols with no space
+
+            Example:
+
+            "25 $35 bills."
+
+            In that instance, prefer "35" over "25"
+            '''
+
+            # symbol states where a currency symbol can be placed
+            symbol = self.symbol_condition[key]
+
+            dictionary = {
+                'symbol' : key,
+                'symbol_type' : symbol["type"],
+                'currency' : symbol.get("currency", self.currency_from)
+            }
+
+            if (symbol["placed_before"] == True) and (symbol["placed_after"] == True):
+                num, amount_span = self.find_number(text, move_backwards=True, symbol_index=start, condition=symbol)
+                if num != None and amount_span[0] < claimed_end and amount_span not in claimed_spans:
+                    num = None
+
+                # If numbers are not found to the left of the symbol, look for numbers to the right of the symbol
+                if num == None:
+                    num, amount_span = self.find_number(text, move_backwards=False, symbol_index=end, condition=symbol)
+                    dictionary["symbol_placed"] = "before"
                 else:
-                    break
+                    dictionary["symbol_placed"] = "after"
+
+            elif symbol['placed_before'] == True:
+                num, amount_span = self.find_number(text, move_backwards=True, symbol_index=start, condition=symbol)
+                if num != None and amount_span[0] < claimed_end and amount_span not in claimed_spans:
+                    num = None
+
+                # Dictionary stores where symbol is relative to number
+                dictionary["symbol_placed"] = "after"
+
+            elif symbol['placed_after'] == True:
+                num, amount_span = self.find_number(text, move_backwards=False, symbol_index=end, condition=symbol)
+                dictionary["symbol_placed"] = "before"
+
             else:
-                num.append(char)
-                if move_backwards:
-                    i -= 1
-                else:
-                    i += 1
+                continue
 
-        if num == []:
-            return None
+            # Skip symbols that are not next to a number
+            if num == None:
+                PROFILER.count("rejected_symbols.no_number")
+                continue
 
-        if move_backwards:
-            # Reverse num
-            num = num[::-1]
+            # Convert the amount to a number. Amounts that are not valid numbers (e.g. "7," in "7, USD") are skipped.
+            try:
+                value = parse_number(num)
+            except (ValueError, IndexError):
+                PROFILER.count("rejected_symbols.invalid_amount")
+                continue
 
-        num = ''.join(num)
-        num = num.strip()
-        return num
+            # Offsets of the symbol and the amount in `text`
+            dictionary["amount"] = num
+            dictionary["symbol_span"] = (start, end)
+            dictionary["amount_span"] = amount_span
+            dictionary["value"] = value
+            prices.append(dictionary)
 
-    def find_symbol(self):
+            claimed_spans.add(amount_span)
+            claimed_end = max(claimed_end, amount_span[1])
+
+        return prices
+
+
+# Number of PriceMatchers kept by `get_price_matcher`
+PRICE_MATCHER_CACHE_SIZE = 256
+
+_price_matchers = OrderedDict()
+_price_matchers_lock = threading.Lock()
+
+
+def get_price_matcher(currency_from: str, symbol_condition: dict, whole_words=False, options=()) -> PriceMatcher:
+    """
+    Returns the PriceMatcher of `currency_from` with `symbol_condition` and `whole_words`.
+
+    PriceMatchers are kept in a least-recently-used cache of PRICE_MATCHER_CACHE_SIZE entries keyed
+    by `currency_from`, `whole_words` and `options`. `options` is a hashable value that identifies
+    anything else that `symbol_condition` was built from (e.g. the currency data file or the symbol
+    defaults used to detect currencies). On a cache hit, `symbol_condition` is not used.
+    """
+    key = (currency_from, whole_words, options)
+    with _price_matchers_lock:
+        matcher = _price_matchers.get(key)
+        if matcher is not None:
+            _price_matchers.move_to_end(key)
+            return matcher
+
+    matcher = PriceMatcher(currency_from, symbol_condition, whole_words)
+
+    with _price_matchers_lock:
+        _price_matchers[key] = matcher
+        if len(_price_matchers) > PRICE_MATCHER_CACHE_SIZE:
+            _price_matchers.popitem(last=False)
+
+    return matcher
+
+
+class PriceParser:
+    '''
+    Finds all prices associated with `currency_from` in `text`.
+
+    The prices are found by a PriceMatcher. Pass `matcher` (e.g. from `get_price_matcher()`) to
+    reuse a PriceMatcher. Otherwise, one is built from `symbol_condition` or `currency_data`.
+    '''
+
+    def __init__(self, currency_from, currency_data, text, symbol_condition=None, whole_words=False, matcher=None):
+        self.currency_from = currency_from
+        self.text = text
         self.prices = []
 
-        # Find each symbol in self.text
-        for key in self.SYMBOL_CONDITION.keys():
-            condition = self.SYMBOL_CONDITION[key]
+        # Stores indices of where the currency index occurs
+        self.currency_indices = {}
 
-            # If the symbol is a "$", escape it so that regex works.
-            # "$" in regex matches from the current position to the end of a line
-            if key == '$':
-                symbol = r"\$"
-            else:
-                symbol = key
+        if matcher is None:
+            # A precomputed `symbol_condition` (e.g. from CurrencyIndex) can be passed in to skip building it again.
+            if symbol_condition is None:
+                symbol_condition = get_symbol_condition(currency_from, currency_data)
+            matcher = PriceMatcher(currency_from, symbol_condition, whole_words)
 
-            matches = re.finditer(symbol, self.text)
-            self.currency_indices[key] = [(match.start(), match.end()) for match in matches]
-        
-        # Find numbers next to self.currency_indices
-        numbers = []
+        self.matcher = matcher
+        self.whole_words = matcher.whole_words
 
-        for key in self.currency_indices.keys():
-            symbol_matches = self.currency_indices[key]
+        # `self.SYMBOL_CONDITION` states when a currency symbol can be used in English. See `get_symbol_condition`.
+        self.SYMBOL_CONDITION = matcher.symbol_condition
 
-            # symbol states where a currency symbol can be placed
-            symbol = self.SYMBOL_CONDITION[key]
+    def find_number(self, move_backwards: bool, symbol_index: int, condition: dict) -> tuple:
+        """
+        Finds number located next to symbol_index in self.text. See `PriceMatcher.find_number`.
+        """
+        return self.matcher.find_number(self.text, move_backwards, symbol_index, condition)
 
-            for match in symbol_matches:
-                '''
-                TODO: if a currency symbol is next to two numbers, create a preference for numbers next to symbols with no space
+    def find_symbol(self):
+        self.currency_indices = {}
 
-                Example:
+        symbol_matches = self.matcher.find_symbols(self.text)
+        for key, start, end in symbol_matches:
+            self.currency_indices.setdefault(key, []).append((start, end))
+
+        self.prices = self.matcher.find_prices(self.text, symbol_matches)
+
+
+def get_symbol_condition(currency_from: str, currency_data: dict) -> dict:
+    """
+    Returns the symbols of `currency_from` and when each symbol can be used in English.
+
+    Each symbol maps to a dictionary with 4 keys:
+
+    - placed_before: currency symbol may be placed before a quantity.
+    - placed_after: currency symbol may be placed after a quantity.
+    - spaces_allowed: currency symbol may have a space between it and the amount.
+    - type: which form of the currency the symbol is (ISO code, symbol, name, ...).
+
+    NOTE: for `currency_data['symbol']` and `currency_data['symbolNative']`,
+    some currencies only allow you to place a symbol before or after the amount.
+    However, this common grammatical mistake will be automatically converted.
+    """
+    # Get name and plural name of currency
+    name = currency_data["name"].replace(currency_data["demonym"], "") # Remove demonym from currency
+    plural_name = name.replace(currency_data["majorSingle"], currency_data["majorPlural"])
+    name = name.strip().upper()
+    plural_name = plural_name.strip().upper()
+
+    return {
+        currency_from: {
+            'placed_before': True,
+            'placed_after': True,
+            'spaces_allowed': "optional",
+            "type" : "ISO"
+        },
+        currency_data['symbol']: {
+            'placed_before': True,
+            'placed_after': True,
+            'spaces_allowed': "optional" if len(currency_data['symbol']) > 1 else "required",
+            "type" : "symbol"
+        },
+        currency_data['symbolNative']: {
+            'placed_before': True,
+            'placed_after': True,
+            'spaces_allowed': "forbidden",
+            "type" : "symbol_native"
+        },
+        currency_data['name'].upper(): {
+            'placed_before': False,
+            'placed_after': True,
+            'spaces_allowed': "optional",
+            "type": "denonym_name"
+        },
+        name: {
+            'placed_before': False,
+            'placed_after': True,
+            'spaces_allowed': "required",
+            "type" : "name"
+        },
+        plural_name: {
+            'placed_before': False,
+            'placed_after': True,
+            'spaces_allowed': "required",
+            "type" : "plural_name"
+        }
+    }
 
-                "25 $35 bills."
 
-                In that instance, prefer "35" over "25"
-                '''
+@lru_cache(maxsize=None)
+def compile_symbol_scanner(symbols: tuple, whole_words=False) -> re.Pattern:
+    """
+    Compiles a single regex that finds every symbol in `symbols` in one pass over a text.
 
-                start, end = match
+    Each symbol is escaped, so symbols such as "د.إ." or "Rs." are matched literally.
+    The longest symbol at a position is matched, so "DOLLARS" is matched instead of "DOLLAR"
+    and "CA$" is matched instead of "$". Empty symbols are ignored.
 
-                dictionary = {
-                    'symbol' : key,
-                    'symbol_type' : symbol["type"]
-                }
+    The symbols are arranged in a trie (e.g. "DOLLAR" and "DOLLARS" become "DOLLAR(?:S|)"),
+    so the regex does not try every symbol at every position of the text. This matters when
+    hundreds of symbols are scanned at once.
 
-                if (symbol["placed_before"] == True) and (symbol["placed_after"] == True):
-                    num = self.find_number(move_backwards=True, symbol_index=start, condition=condition)
+    If `whole_words` is True, a symbol that starts or ends with a letter is not matched
+    next to another letter, so "R" is not found in "RENT" and "USD" is not found in "USDT".
 
-                    # If numbers are not found to the left of the symbol, look for numbers to the right of the symbol
-                    if num == None:
-                        num = self.find_number(move_backwards=False, symbol_index=end, condition=condition)
-                        dictionary["symbol_placed"] = "before"
-                    else:
-                        dictionary["symbol_placed"] = "after"
+    The compiled scanner is cached, so it is built only once per currency.
+    """
+    trie = {}
+    for symbol in symbols:
+        if not symbol:
+            continue
 
-                    dictionary["amount"] = num
-                    numbers.append(dictionary)
+        node = trie
+        for char in symbol:
+            node = node.setdefault(char, {})
+        node[SYMBOL_END] = True
 
-                
-                elif symbol['placed_before'] == True:
-                    num = self.find_number(move_backwards=True, symbol_index=start, condition=condition)
-                    dictionary["amount"] = num
+    if not trie:
+        # A pattern that never matches
+        return re.compile(r"(?!)")
 
-                    # Dictionary stores where symbol is relative to number
-                    dictionary["symbol_placed"] = "after"
-                    numbers.append(dictionary)
+    branches = []
+    for char, child in sorted(trie.items()):
+        branch = re.escape(char)
+        if whole_words and char.isalpha():
+            # Not matched right after a letter. The check comes after the first character so
+            # that the regex engine can still skip quickly to characters that can start a symbol.
+            branch += f"(?<![^\\W\\d_]{re.escape(char)})"
+        branches.append(branch + _trie_pattern(child, char, whole_words))
 
-                elif symbol['placed_after'] == True:
-                    num = self.find_number(move_backwards=False, symbol_index=end, condition=condition)
-                    dictionary["amount"] = num
-                    
-                    dictionary["symbol_placed"] = "before"
-                    numbers.append(dictionary)
+    return re.compile("|".join(branches))
+
+
+@lru_cache(maxsize=None)
+def compile_byte_symbol_scanner(symbols: tuple) -> re.Pattern:
+    """
+    Compiles a regex that finds every symbol in `symbols` in UTF-8 encoded bytes (e.g. a memory-mapped file).
+
+    Each byte of the UTF-8 encoding of a symbol is treated as one Latin-1 character, so the
+    trie of `compile_symbol_scanner` can be reused and encoded back to a bytes pattern.
+    A UTF-8 symbol can never match in the middle of another character.
+
+    Whole words are not checked, so the scanner finds a superset of the symbols found by
+    `compile_symbol_scanner(symbols, whole_words=True)`.
+    """
+    latin1_symbols = tuple(symbol.encode("utf-8").decode("latin-1") for symbol in symbols)
+    return re.compile(compile_symbol_scanner(latin1_symbols).pattern.encode("latin-1"))
+
+
+# Marks the end of a symbol in the trie built by `compile_symbol_scanner`
+SYMBOL_END = ""
+
+
+def _trie_pattern(node: dict, char: str, whole_words: bool) -> str:
+    # Longer symbols are tried before the symbol ending at this node
+    branches = [re.escape(next_char) + _trie_pattern(child, next_char, whole_words)
+                for next_char, child in sorted(node.items()) if next_char != SYMBOL_END]
 
-            for i, number in enumerate(numbers):
-                if number['amount'] == None:
-                    numbers.pop(i)
+    if SYMBOL_END in node:
+        branches.append(NOT_BEFORE_LETTER if whole_words and char.isalpha() else "")
 
-        self.prices = numbers
+    if len(branches) == 1:
+        return branches[0]
 
-        # Convert each string in self.prices to a number
-        for i, price in enumerate(self.prices):
-            amount = price['amount']
-            num_parser = NumberParser(amount)
-            num_parser.find()
-            self.prices[i]["value"] = num_parser.result
+    return "(?:" + "|".join(branches) + ")"
@@ -0,0 +1,322 @@
+import argparse
+import json
+import math
+import struct
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, UTC
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where only the threads of one process are kept from appending at the same time
+    fcntl = None
+
+# File that every downloaded set of exchange rates is appended to
+HISTORY_FILE = 'exchange_rates.history'
+
+# Written once at the start of the file
+FILE_HEADER = b"CTRH\x01"
+
+# Each record is a header followed by `count` (currency, rate) pairs. Integers and floats are little-endian.
+RECORD_HEADER = struct.Struct("<qq3sH")
+RATE = struct.Struct("<3sd")
+
+
+class RateHistory:
+    '''
+    An append-only store of every set of exchange rates that was downloaded, used to convert
+    a text with the exchange rates of a past date.
+
+    Each set of rates is appended to `path` as one binary record:
+
+    | Field                  | Type                         | Size                  |
+    | ---------------------- | ---------------------------- | --------------------- |
+    | time_last_update_unix  | 64-bit integer               | 8 bytes               |
+    | time_next_update_unix  | 64-bit integer               | 8 bytes               |
+    | base_code              | 3 ASCII characters           | 3 bytes               |
+    | count                  | 16-bit integer               | 2 bytes               |
+    | rates                  | count * (currency, float64)  | 11 bytes per currency |
+
+    A set of rates for 160 currencies takes under 2 KB, so many years of daily rates fit in a
+    few megabytes. The file is only read when the history is first used. In memory, the times
+    are stored in one sorted array('q'), and the rates of each currency in an array('d') with
+    one rate per time (NaN if the currency had no rate at that time). `get_rates` finds the
+    rates in effect at a time with a binary search.
+
+    Example usage:
+
+        history = RateHistory()
+        rate_table = history.get_rates(datetime(2024, 3, 5, tzinfo=UTC).timestamp())
+        converter = CurrencyConverter(rate_table)
+    '''
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.loaded = False
+
+        # Offset in the file after the last complete record. New records are written there.
+        self.end = 0
+
+        # The times, next update times and base currencies of every set of rates, sorted by time
+        self.times = array('q')
+        self.next_times = array('q')
+        self.base_codes = []
+
+        # Currency code -> array('d') of its rate at each time
+        self.columns = {}
+
+        # Rate tables built by `get_rates`, keyed by time, so the same rate table is returned every time
+        self.rate_tables = {}
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self.times)
+
+    def load(self):
+        """
+        Reads the history from self.path. Does nothing if it was already read.
+
+        Reading stops at a record that was only partly written (e.g. when the program was stopped
+        while writing it) or cannot be read. That record and everything after it are ignored, and
+        are replaced by the next record that is appended.
+        """
+        with self.lock:
+            if self.loaded:
+                return
+
+            try:
+                with open(self.path, "rb") as file:
+                    data = file.read()
+            except FileNotFoundError:
+                data = b""
+
+            if data.startswith(FILE_HEADER):
+                records, self.end = read_records(data, len(FILE_HEADER))
+            elif FILE_HEADER.startswith(data):
+                # The file is empty, or the program was stopped while writing its header
+                records, self.end = [], 0
+            else:
+                raise ValueError(f"{self.path} is not an exchange rate history file.")
+
+            for record in sorted(records, key=lambda record: record[0]):
+                self.insert(*record)
+            self.loaded = True
+
+    def insert(self, time_last_update: int, time_next_update: int, base_code: str, rates: dict) -> bool:
+        # Adds a set of rates to the arrays in memory. Returns False if rates of that time are already stored.
+        if self.is_stored(time_last_update):
+            return False
+
+        i = bisect_left(self.times, time_last_update)
+        self.times.insert(i, time_last_update)
+        self.next_times.insert(i, time_next_update)
+        self.base_codes.insert(i, base_code)
+
+        for currency, column in self.columns.items():
+            column.insert(i, rates.get(currency, math.nan))
+
+        # Currencies that were not in any earlier set of rates
+        for currency in rates.keys() - self.columns.keys():
+            column = array('d', [math.nan]) * len(self.times)
+            column[i] = rates[currency]
+            self.columns[currency] = column
+
+        return True
+
+    def append(self, rate_table: dict) -> bool:
+        """
+        Adds a rate table as returned by the API (see `ExchangeRates.get_rates`) to the history.
+
+        Returns False if rates with the same `time_last_update_unix` are already stored. Rates of
+        keys that are not 3-letter currency codes (e.g. "Abkhazia") are not stored.
+        Raises ValueError if the base currency is not a 3-letter currency code.
+        """
+        self.load()
+
+        time_last_update = int(rate_table["time_last_update_unix"])
+        time_next_update = int(rate_table["time_next_update_unix"])
+        base_code = rate_table.get("base_code", "USD")
+        rates = {currency: rate for currency, rate in rate_table["rates"].items() if is_currency_code(currency)}
+
+        with self.lock:
+            if self.is_stored(time_last_update):
+                return False
+
+        record = [RECORD_HEADER.pack(time_last_update, time_next_update, encode_currency(base_code), len(rates))]
+        for currency, rate in rates.items():
+            record.append(RATE.pack(encode_currency(currency), rate))
+        record = b"".join(record)
+
+        with self.lock, open(self.path, "a+b") as file:
+            # Other processes (e.g. the server and a command-line run) append to the same file. The
+            # lock is held until the file is closed, so no record is read, cut or written while
+            # another process writes one.
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+
+            # Read the records that other processes appended since the history was loaded
+            file.seek(self.end)
+            tail = file.read()
+            if self.end == 0 and tail.startswith(FILE_HEADER):
+                self.end = len(FILE_HEADER)
+                tail = tail[len(FILE_HEADER):]
+
+            records, tail_end = read_records(tail, 0)
+            for other_record in records:
+                self.insert(*other_record)
+            self.end += tail_end
+
+            # Remove a partly written record, so that the new record starts where the last complete one ends
+            if tail_end < len(tail):
+                file.truncate(self.end)
+
+            if not self.insert(time_last_update, time_next_update, base_code, rates):
+                return False
+
+            if self.end == 0:
+                file.write(FILE_HEADER)
+                self.end = len(FILE_HEADER)
+
+            # Write the record in a single call so that a stopped program leaves at most one partial record
+            file.write(record)
+            self.end = file.tell()
+
+        return True
+
+    def is_stored(self, time_last_update: int) -> bool:
+        i = bisect_left(self.times, time_last_update)
+        return i < len(self.times) and self.times[i] == time_last_update
+
+    def find(self, timestamp: float) -> int:
+        """
+        Returns the index of the rates in effect at `timestamp` (Unix time): the last rates published
+        at or before `timestamp`.
+
+        Raises ValueError if no rates were published before `timestamp`.
+        """
+        self.load()
+
+        i = bisect_right(self.times, timestamp) - 1
+        if i < 0:
+            raise ValueError(f"No exchange rates were saved before {format_time(timestamp)}. "
+                             f"Rates are saved to {self.path} each time they are downloaded.")
+        return i
+
+    def get_rates(self, timestamp: float) -> dict:
+        """
+        Returns the rate table in effect at `timestamp` (Unix time), in the same format as
+        `ExchangeRates.get_rates`. The same rate table is returned for every timestamp it is in effect for.
+        """
+        i = self.find(timestamp)
+        time_last_update = self.times[i]
+
+        with self.lock:
+            rate_table = self.rate_tables.get(time_last_update)
+            if rate_table is None:
+                rate_table = {
+                    "result": "success",
+                    "time_last_update_unix": time_last_update,
+                    "time_next_update_unix": self.next_times[i],
+                    "base_code": self.base_codes[i],
+                    "rates": {currency: column[i] for currency, column in self.columns.items() if not math.isnan(column[i])}
+                }
+                self.rate_tables[time_last_update] = rate_table
+
+        return rate_table
+
+    def get_range(self, start: float, end: float, currencies=None) -> tuple:
+        """
+        Returns the times of the rates published between `start` and `end` (inclusive, in Unix
+        time) and a dictionary that maps each currency in `currencies` (every currency by default)
+        to an array of its rates at those times.
+        """
+        self.load()
+
+        first = bisect_left(self.times, start)
+        last = bisect_right(self.times, end)
+        if currencies is None:
+            currencies = self.columns.keys()
+
+        return self.times[first:last], {currency: self.columns[currency][first:last] for currency in currencies}
+
+
+def read_records(data: bytes, position: int) -> tuple:
+    """
+    Reads the records in `data` that start at `position`. Returns a list of
+    (time_last_update, time_next_update, base_code, rates) tuples and the position after the
+    last complete record.
+
+    Reading stops at a record that is incomplete or has a currency code that is not 3 letters.
+    """
+    records = []
+    while position + RECORD_HEADER.size <= len(data):
+        time_last_update, time_next_update, base_code, count = RECORD_HEADER.unpack_from(data, position)
+        end = position + RECORD_HEADER.size + count * RATE.size
+        if end > len(data):
+            break
+
+        try:
+            base_code = decode_currency(base_code)
+            rates = {}
+            for i in range(position + RECORD_HEADER.size, end, RATE.size):
+                currency, rate = RATE.unpack_from(data, i)
+                rates[decode_currency(currency)] = rate
+        except ValueError:
+            break
+
+        records.append((time_last_update, time_next_update, base_code, rates))
+        position = end
+
+    return records, position
+
+
+def is_currency_code(currency: str) -> bool:
+    return len(currency) == 3 and currency.isascii() and currency.isalpha()
+
+
+def encode_currency(currency: str) -> bytes:
+    if not is_currency_code(currency):
+        raise ValueError(f"{currency} is not a 3-letter currency code.")
+    return currency.encode("ascii")
+
+
+def decode_currency(code: bytes) -> str:
+    # UnicodeDecodeError is a ValueError
+    currency = code.decode("ascii")
+    if not is_currency_code(currency):
+        raise ValueError(f"{currency!r} is not a 3-letter currency code.")
+    return currency
+
+
+def format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, UTC).strftime("%Y-%m-%d %H:%M:%SZ")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add saved exchange rates (e.g. old copies of exchange_rates.json) to the exchange rate history.")
+
+    parser.add_argument('files',
+                        nargs='*',
+                        help='JSON files in the format of exchange_rates.json.')
+    parser.add_argument('--history',
+                        default=HISTORY_FILE,
+                        help=f'History file to add the rates to. Default: {HISTORY_FILE}')
+
+    args = parser.parse_args()
+
+    history = RateHistory(args.history)
+    for path in args.files:
+        with open(path) as file:
+            rate_table = json.load(file)
+
+        if history.append(rate_table):
+            print(f"Added exchange rates from {format_time(rate_table['time_last_update_unix'])} ({path}).")
+        else:
+            print(f"Exchange rates from {format_time(rate_table['time_last_update_unix'])} are already saved ({path}).")
+
+    if len(history) == 0:
+        print(f"{args.history} contains no exchange rates.")
+    else:
+        print(f"{args.history} contains {len(history)} sets of exchange rates from {format_time(history.times[0])} to {format_time(history.times[-1])}.")
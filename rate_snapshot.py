@@ -0,0 +1,115 @@
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, UTC
+from decimal import Decimal
+
+# Number of RateSnapshots kept by `get_rate_snapshot`
+SNAPSHOT_CACHE_SIZE = 4
+
+
+class RateSnapshot:
+    '''
+    The exchange rates of one update of `exchange_rates.json`, prepared for fast conversions.
+
+    Every currency in the rate table gets an integer ID (its position in self.currencies). The
+    rate of currency i is stored at `rates[i]` as a float and at `exact_rates[i]` as a Decimal,
+    so the exchange rate between two currencies is a lookup of two IDs and one division.
+
+    | Attribute             | Description                                                     |
+    | --------------------- | --------------------------------------------------------------- |
+    | rate_table            | The rate table the snapshot was built from                      |
+    | version               | `time_last_update_unix` of the rate table                       |
+    | currencies            | Tuple of currency codes. The index of a code is its ID          |
+    | currency_ids          | Maps each currency code to its ID                               |
+    | rates                 | array('d') of the rate of each currency                         |
+    | exact_rates           | Tuple of the rate of each currency as a Decimal                 |
+    | exact_cross_rates     | Exact cross rates of the pairs that have been used              |
+
+    The rates of a RateSnapshot never change. Only `exact_cross_rates` grows as more pairs are
+    used, and each entry is computed from `exact_rates`. Results that record the `version` of
+    the snapshot they used can be reproduced even if the rates are updated later.
+    '''
+    __slots__ = ("rate_table", "version", "currencies", "currency_ids", "rates", "exact_rates", "exact_cross_rates")
+
+    def __init__(self, rate_table: dict):
+        self.rate_table = rate_table
+        self.version = rate_table.get("time_last_update_unix")
+
+        rates = rate_table["rates"]
+        self.currencies = tuple(sorted(rates))
+        self.currency_ids = {currency: i for i, currency in enumerate(self.currencies)}
+        self.rates = array('d', (rates[currency] for currency in self.currencies))
+
+        # The rates are read as decimal strings, so no binary float rounding is introduced
+        self.exact_rates = tuple(Decimal(str(rates[currency])) for currency in self.currencies)
+
+        # Exact Decimal cross rates, computed when a pair is first used. See `exact_cross_rate`.
+        self.exact_cross_rates = {}
+
+    def __repr__(self) -> str:
+        return f"RateSnapshot(version={self.version}, currencies={len(self.currencies)})"
+
+    @property
+    def last_update(self) -> str:
+        if self.version is None:
+            return "Unknown"
+        return datetime.fromtimestamp(self.version, UTC).strftime("%Y-%m-%d %H:%M:%SZ")
+
+    def currency_id(self, currency: str) -> int:
+        try:
+            return self.currency_ids[currency]
+        except KeyError:
+            raise KeyError(f"{currency} not found in exchange rates.")
+
+    def cross_rate(self, currency_from: str, currency_to: str) -> float:
+        """
+        Returns the exchange rate from `currency_from` to `currency_to`.
+
+        Raises KeyError if either currency is not in the rate table.
+        """
+        return self.rates[self.currency_id(currency_to)] / self.rates[self.currency_id(currency_from)]
+
+    def exact_cross_rate(self, currency_from: str, currency_to: str) -> Decimal:
+        """
+        Returns the exact exchange rate from `currency_from` to `currency_to` as a Decimal.
+
+        The rate of each pair is computed once from `exact_rates` and reused.
+        """
+        pair = (self.currency_id(currency_from), self.currency_id(currency_to))
+        rate = self.exact_cross_rates.get(pair)
+        if rate is None:
+            rate = self.exact_rates[pair[1]] / self.exact_rates[pair[0]]
+            self.exact_cross_rates[pair] = rate
+
+        return rate
+
+
+_snapshots = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+def get_rate_snapshot(rate_table: dict) -> RateSnapshot:
+    """
+    Returns the RateSnapshot of `rate_table`.
+
+    `ExchangeRates.get_rates()` returns the same rate table until the rates are updated, so the
+    snapshot of the last few rate tables is kept instead of building it again.
+    """
+    key = (id(rate_table), rate_table.get("time_last_update_unix"))
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+
+        # The snapshot keeps its rate table alive, so its id cannot be reused by another rate table
+        if snapshot is not None and snapshot.rate_table is rate_table:
+            _snapshots.move_to_end(key)
+            return snapshot
+
+    snapshot = RateSnapshot(rate_table)
+
+    with _snapshots_lock:
+        _snapshots[key] = snapshot
+        if len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+
+    return snapshot
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from atomic_file import atomic_write
+from instrumentation import PROFILER
+
+# Default number of results kept in memory
+MEMORY_ENTRIES = 1024
+
+# Default size of the on-disk store in bytes
+DISK_SIZE = 256 * 1024 * 1024
+
+
+class ResultCache:
+    '''
+    Remembers the results of converting texts, so an identical text is never parsed twice.
+
+    A result is stored under a key made from the SHA-256 hash of the text, the two currencies and
+    the converter's options (see `make_key`), together with the `time_last_update_unix` of the
+    exchange rates it was converted with.
+
+    | Tier   | Storage                                      | Bound                       |
+    | ------ | -------------------------------------------- | --------------------------- |
+    | memory | least-recently-used dictionary               | `memory_entries` results    |
+    | disk   | one pickle file per result in `directory`    | `disk_size` bytes           |
+
+    The disk tier is only used if `directory` is given. When it grows past `disk_size`, the
+    least recently used files are deleted. Since the key contains the time of the exchange
+    rates, results are never reused after new rates are downloaded. Results of older rates are
+    dropped from memory and deleted from disk as soon as a result for newer rates is stored.
+
+    Results are shared, so they must not be changed.
+
+    A ResultCache is pickled without its results, so worker processes get an empty memory tier
+    and share the disk tier.
+    '''
+    def __init__(self, memory_entries=MEMORY_ENTRIES, directory=None, disk_size=DISK_SIZE):
+        self.memory_entries = memory_entries
+        self.directory = directory
+        self.disk_size = disk_size
+        self.lock = threading.Lock()
+
+        self.memory = OrderedDict()
+        self.version = None
+        self.disk_used = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self) -> dict:
+        return {"memory_entries": self.memory_entries, "directory": self.directory, "disk_size": self.disk_size}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    @staticmethod
+    def make_key(text: str, currency_from: str, currency_to: str, options=()) -> str:
+        """
+        Returns the key of the result of converting `text` from `currency_from` to `currency_to`
+        with the converter options `options`.
+        """
+        digest = hashlib.sha256(f"{currency_from}\0{currency_to}\0{options!r}\0".encode("utf-8"))
+        digest.update(text.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def get(self, key: str, version):
+        """
+        Returns the result stored under `key` for the exchange rates of `version`, or None.
+        """
+        with self.lock:
+            if version == self.version and key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                PROFILER.count("result_cache.memory_hits")
+                return self.memory[key]
+
+        if self.directory is not None:
+            path = self.get_path(key, version)
+            try:
+                with open(path, "rb") as file:
+                    result = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+                pass
+            else:
+                # Mark the file as recently used
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+
+                self.put_memory(key, version, result)
+                with self.lock:
+                    self.disk_hits += 1
+                PROFILER.count("result_cache.disk_hits")
+                return result
+
+        with self.lock:
+            self.misses += 1
+        PROFILER.count("result_cache.misses")
+        return None
+
+    def put(self, key: str, version, result):
+        new_version = self.put_memory(key, version, result)
+
+        if self.directory is None:
+            return
+
+        try:
+            with atomic_write(self.get_path(key, version)) as file:
+                pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+                size = file.tell()
+        except OSError:
+            # The cache still works in memory, e.g. if the disk is full
+            return
+
+        with self.lock:
+            if self.disk_used is not None:
+                self.disk_used += size
+            evict = new_version or self.disk_used is None or self.disk_used > self.disk_size
+
+        if evict:
+            self.evict_disk(version)
+
+    def put_memory(self, key: str, version, result) -> bool:
+        # Returns True if `version` is newer than the version of the results stored so far
+        with self.lock:
+            new_version = version != self.version
+            if new_version:
+                # Results of other exchange rates are never used again
+                self.memory.clear()
+                self.version = version
+
+            self.memory[key] = result
+            self.memory.move_to_end(key)
+            if len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+        return new_version
+
+    def get_path(self, key: str, version) -> str:
+        return os.path.join(self.directory, f"{version}-{key}.pickle")
+
+    def evict_disk(self, version):
+        """
+        Deletes the results of exchange rates older than `version`, then the least recently used
+        results until the disk tier is smaller than self.disk_size.
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".pickle"):
+                continue
+
+            try:
+                # Another process may still be using newer rates, so only older results are deleted
+                if is_older_version(entry.name.split("-", 1)[0], version):
+                    os.remove(entry.path)
+                    continue
+
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        files.sort()
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.disk_size:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= file_size
+
+        with self.lock:
+            self.disk_used = size
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory)
+        }
+
+
+def is_older_version(file_version: str, version) -> bool:
+    # Versions are `time_last_update_unix` timestamps
+    try:
+        return int(file_version) < int(version)
+    except (TypeError, ValueError):
+        return file_version != str(version)
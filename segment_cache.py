@@ -0,0 +1,137 @@
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+
+from atomic_file import atomic_write
+from instrumentation import PROFILER
+
+# Default number of segments whose prices are remembered
+MAX_SEGMENTS = 100000
+
+
+class SegmentCache:
+    '''
+    Remembers the prices found in each line of a text, so when an edited text is converted
+    again, only the lines that changed are searched for prices.
+
+    Prices never span more than one line (a symbol and its amount are separated by at most
+    one space), so a line always contains the same prices wherever it is in a text. Each line
+    is stored under the SHA-256 hash of its content, the currency it was searched for and the
+    converter's options. The prices of unchanged lines are reused with their offsets moved to
+    the line's new position, and are then converted with the current exchange rates. Prices
+    are shared between texts, so they must not be changed.
+
+    | Text                       | Work done                                        |
+    | -------------------------- | ------------------------------------------------ |
+    | First conversion           | Every line is hashed and searched for prices     |
+    | One paragraph edited       | Every line is hashed, the edited lines searched  |
+    | New exchange rates         | Every line is hashed, no line is searched        |
+
+    At most `max_segments` lines are remembered. The least recently used lines are forgotten
+    first. Use `load` and `save` to keep the cache between runs, e.g. when a text editor runs
+    the converter every time a document is saved.
+    '''
+    def __init__(self, max_segments=MAX_SEGMENTS):
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+
+        # Segment key -> tuple of the prices in the segment
+        self.segments = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> dict:
+        return {"max_segments": self.max_segments, "segments": self.segments}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["max_segments"])
+        self.segments = state["segments"]
+
+    @classmethod
+    def load(cls, path: str, max_segments=MAX_SEGMENTS):
+        """
+        Returns the SegmentCache saved at `path`, or an empty SegmentCache if `path` does not exist or cannot be read.
+        """
+        try:
+            with open(path, "rb") as file:
+                cache = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return cls(max_segments)
+
+        if not isinstance(cache, cls):
+            return cls(max_segments)
+
+        cache.max_segments = max_segments
+        cache.trim()
+        return cache
+
+    def save(self, path: str):
+        # An interrupted save does not lose the cache saved before
+        with self.lock, atomic_write(path) as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def find_prices(self, text: str, matcher, options=()) -> list:
+        """
+        Returns the prices in `text` found by `matcher` (a PriceMatcher), like `matcher.find_prices(text)`.
+
+        `options` is a hashable value that identifies the converter options `matcher` was built with.
+        """
+        # Hash the currency and options once. Each line continues from a copy of this hash.
+        prefix = hashlib.sha256(f"{matcher.currency_from}\0{options!r}\0".encode("utf-8"))
+
+        prices = []
+        position = 0
+        hits = 0
+        misses = 0
+        for segment in text.splitlines(keepends=True):
+            digest = prefix.copy()
+            digest.update(segment.encode("utf-8", "surrogatepass"))
+            key = digest.digest()
+
+            with self.lock:
+                segment_prices = self.segments.get(key)
+                if segment_prices is not None:
+                    self.segments.move_to_end(key)
+
+            if segment_prices is None:
+                segment_prices = tuple(matcher.find_prices(segment))
+                with self.lock:
+                    self.segments[key] = segment_prices
+                misses += 1
+            else:
+                hits += 1
+
+            # Move the offsets of each price from the line to the text
+            for price in segment_prices:
+                if position == 0:
+                    prices.append(price)
+                    continue
+
+                symbol_start, symbol_end = price['symbol_span']
+                amount_start, amount_end = price['amount_span']
+                prices.append({
+                    **price,
+                    'symbol_span': (symbol_start + position, symbol_end + position),
+                    'amount_span': (amount_start + position, amount_end + position)
+                })
+
+            position += len(segment)
+
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+        PROFILER.count("segment_cache.hits", hits)
+        PROFILER.count("segment_cache.misses", misses)
+
+        self.trim()
+        return prices
+
+    def trim(self):
+        with self.lock:
+            while len(self.segments) > self.max_segments:
+                self.segments.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "segments": len(self.segments)}
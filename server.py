@@ -0,0 +1,281 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+
+from currency_text_converter import AUTO_DETECT, ROUNDING_MODES, CurrencyConverter, TextCurrencyConverter
+from segment_cache import SegmentCache
+
+# Seconds to wait before trying again when the exchange rates could not be updated
+RETRY_INTERVAL = 60
+
+# Largest request body accepted, in bytes
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+class ConversionService:
+    '''
+    Keeps everything needed to convert texts in memory between requests: the currency index,
+    the compiled symbol scanners of every valid currency and the exchange rates.
+
+    The exchange rates are refreshed by a background thread once `time_next_update_unix` has
+    passed, so requests never wait for the rate API. Until new rates are downloaded, the
+    previous rates are used.
+
+    Example usage:
+
+        service = ConversionService(TextCurrencyConverter())
+        service.start()
+        service.convert("It costs $5.", "USD", "EUR")
+    '''
+    def __init__(self, converter: TextCurrencyConverter):
+        self.converter = converter
+        self.currency_converter = converter.currency_converter
+        self.stopped = threading.Event()
+        self.refresh_thread = None
+
+        # Build the PriceMatcher of every currency now instead of during the first request for it
+        for currency in converter.valid_currencies:
+            if currency in converter.currency_index.symbol_conditions:
+                converter.get_price_matcher(currency)
+        converter.get_price_matcher(AUTO_DETECT)
+
+    def start(self):
+        self.refresh_thread = threading.Thread(target=self.refresh_rates, daemon=True)
+        self.refresh_thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def refresh_rates(self):
+        exchange_rates = self.converter.exchange_rates
+        while not self.stopped.is_set():
+            next_update_time = self.rate_table["time_next_update_unix"]
+            wait = next_update_time - datetime.now(timezone.utc).timestamp()
+            if wait > 0:
+                self.stopped.wait(wait)
+                continue
+
+            try:
+                rate_table = exchange_rates.get_rates()
+            except Exception as error:
+                print(f"{error}. Trying again in {RETRY_INTERVAL} seconds.")
+                self.stopped.wait(RETRY_INTERVAL)
+                continue
+
+            if rate_table["time_next_update_unix"] <= next_update_time:
+                # The API has not published new rates yet
+                self.stopped.wait(RETRY_INTERVAL)
+                continue
+
+            # Replacing the attribute is atomic, so requests use either the old or the new rates
+            self.currency_converter = CurrencyConverter(rate_table)
+
+    @property
+    def rate_table(self) -> dict:
+        # The exchange rates currently used for conversions
+        return self.currency_converter.rate_table
+
+    def convert(self, text: str, currency_from: str, currency_to: str) -> dict:
+        """
+        Converts the prices in `text` and returns the converted text and the prices that were found.
+
+        Raises ValueError if either currency is not valid.
+        """
+        currency_from = currency_from.upper()
+        currency_to = currency_to.upper()
+        self.converter.check_currency(currency_from, allow_auto_detect=True)
+        self.converter.check_currency(currency_to)
+
+        # Use the same rates for the whole text even if they are refreshed during the conversion
+        currency_converter = self.currency_converter
+        if currency_from == currency_to:
+            return {"text": text, "prices": [], "time_last_update_unix": currency_converter.snapshot.version}
+
+        converted_text, prices, converted_values = self.converter.convert_text(text, currency_from, currency_to, currency_converter)
+        return {
+            "text": converted_text,
+            "prices": [
+                {
+                    "amount": price["amount"],
+                    "currency": price["currency"],
+                    "symbol": price["symbol"],
+                    "converted_amount": value,
+                    "span": [min(price["symbol_span"][0], price["amount_span"][0]), max(price["symbol_span"][1], price["amount_span"][1])]
+                }
+                for price, value in zip(prices, converted_values)
+            ],
+            "time_last_update_unix": currency_converter.snapshot.version
+        }
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Handles the requests of a conversion server.
+
+    | Request        | Body                                      | Response                              |
+    | -------------- | ----------------------------------------- | ------------------------------------- |
+    | POST /convert  | {"text": ..., "from": "USD", "to": "EUR"} | {"text": ..., "prices": [...], ...}   |
+    | GET /health    |                                           | {"status": "ok", ...}                 |
+
+    Errors are returned as {"error": message} with status 400 or 404.
+    '''
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"{self.path} not found."})
+            return
+
+        rates = self.server.service.rate_table
+        self.send_json(200, {"status": "ok", "time_last_update_unix": rates["time_last_update_unix"]})
+
+    def do_POST(self):
+        if self.path != "/convert":
+            # The body is not read, so it must not be parsed as the next request
+            self.close_connection = True
+            self.send_json(404, {"error": f"{self.path} not found."})
+            return
+
+        body_read = False
+        try:
+            length = self.headers.get("Content-Length", "0")
+            if not length.strip().isdigit():
+                raise ValueError("Content-Length must be a whole number of bytes.")
+            length = int(length)
+            if length > MAX_REQUEST_SIZE:
+                raise ValueError(f"Request body must be at most {MAX_REQUEST_SIZE} bytes.")
+
+            body = self.rfile.read(length)
+            body_read = True
+
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise ValueError("Request body must be a JSON object.")
+            for key in ["text", "from", "to"]:
+                if not isinstance(request.get(key), str):
+                    raise ValueError(f'"{key}" must be a string.')
+
+            result = self.server.service.convert(request["text"], request["from"], request["to"])
+        except ValueError as error:
+            # json.JSONDecodeError is a ValueError. A body that was not read must not be parsed as the next request.
+            self.close_connection = not body_read
+            self.send_json(400, {"error": str(error)})
+            return
+        except Exception as error:
+            # Any other error is a bug, but the client still gets a reply
+            self.log_error("Unable to convert request: %r", error)
+            self.send_json(500, {"error": "Internal server error."})
+            return
+
+        self.send_json(200, result)
+
+    def send_json(self, status: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    '''
+    A ThreadingHTTPServer that listens on a Unix socket instead of a TCP port.
+    '''
+    address_family = socket.AF_UNIX
+    daemon_threads = True
+
+    def server_bind(self):
+        # HTTPServer.server_bind expects a (host, port) address
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def make_server(service: ConversionService, host="127.0.0.1", port=8000, socket_path=None, quiet=False) -> HTTPServer:
+    """
+    Returns a server that handles each request in its own thread. If `socket_path` is given, the
+    server listens on that Unix socket. Otherwise, it listens on `host` and `port`.
+    """
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, ConversionRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ConversionRequestHandler)
+
+    server.service = service
+    server.quiet = quiet
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a server that converts the prices in texts from currency A to currency B.")
+
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Address to listen on. Default: 127.0.0.1')
+    parser.add_argument('-p', '--port',
+                        type=int,
+                        default=8000,
+                        help='Port to listen on. Default: 8000')
+    parser.add_argument('--socket',
+                        help='Listen on this Unix socket instead of --host and --port.')
+    parser.add_argument('--symbol_default',
+                        action='append',
+                        default=[],
+                        metavar='SYMBOL=CURRENCY',
+                        help=f'With "from": "{AUTO_DETECT}", the currency that an ambiguous symbol stands for, e.g. --symbol_default "$=CAD". Can be used more than once.')
+    parser.add_argument('--rounding',
+                        choices=ROUNDING_MODES.keys(),
+                        default='down',
+                        help='How converted prices are rounded to the decimal places of the currency they are converted to. Default: down')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Remember the prices found in each line of the texts, so that when an edited text is converted again, only the lines that changed are searched for prices.')
+    parser.add_argument('-q', '--quiet',
+                        action='store_true',
+                        help='Do not log each request.')
+
+    args = parser.parse_args()
+
+    symbol_defaults = {}
+    for symbol_default in args.symbol_default:
+        symbol, separator, currency = symbol_default.rpartition("=")
+        if separator == "" or symbol == "":
+            raise ValueError(f"{symbol_default} must be in the form SYMBOL=CURRENCY.")
+        symbol_defaults[symbol] = currency.upper()
+
+    print("Loading currencies and exchange rates...")
+    start = time.perf_counter()
+    segment_cache = SegmentCache() if args.incremental else None
+    service = ConversionService(TextCurrencyConverter(symbol_defaults=symbol_defaults, rounding=ROUNDING_MODES[args.rounding],
+                                                      segment_cache=segment_cache))
+    service.start()
+    print(f"Loaded in {time.perf_counter() - start:.2f} seconds.")
+
+    server = make_server(service, args.host, args.port, args.socket, args.quiet)
+    print(f"Listening on {args.socket if args.socket else f'http://{args.host}:{args.port}'}...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
@@ -1,15 +1,42 @@
-import requests
 import time
 from datetime import datetime, timezone, UTC
 import json
+import os
+import threading
+
+from atomic_file import atomic_write
+from instrumentation import PROFILER
+from rate_history import HISTORY_FILE, RateHistory
 
 
 class ExchangeRates:
-    def __init__(self, exchange_rate_file='exchange_rates.json'):
+    def __init__(self, exchange_rate_file='exchange_rates.json', url="https://open.er-api.com/v6/latest/USD", history_file=HISTORY_FILE):
         self.exchange_rate_file = exchange_rate_file
         self.ONE_DAY = 24 * 60 * 60
         self.last_update_time = None
-        self.URL = "https://open.er-api.com/v6/latest/USD"
+        self.next_update_time = None
+        self.content = None
+        self.URL = url
+
+        # Seconds to wait for the API to connect and to respond
+        self.TIMEOUT = (5, 30)
+
+        # Number of times a failed download is retried. The wait doubles after each attempt.
+        self.RETRIES = 3
+        self.BACKOFF = 0.5
+
+        # Seconds to keep using outdated rates after a failed download before trying again
+        self.RETRY_INTERVAL = 60
+        self.retry_time = 0
+
+        # HTTP session reused for every download, created on first use
+        self.session = None
+
+        # Every set of downloaded rates is also added to the history, unless history_file is None.
+        # A relative history_file is kept in the same directory as exchange_rate_file.
+        self.history = None
+        if history_file is not None:
+            self.history = RateHistory(os.path.join(os.path.dirname(exchange_rate_file), history_file))
 
     def check_last_update(self):
         # Checks when exchange rates were last updated. Exchange rates update once every 24 hours, so there's no need to update more often than that.
@@ -42,19 +69,235 @@ class ExchangeRates:
             print(f"Exchange rates are up to date. Last updated: {last_update_time_str}. Next available update: {next_update}")
             return
 
-        response = requests.get(self.URL)
+        try:
+            with PROFILER.stage("rate_refresh"):
+                data = self.download()
+                self.write_rates(data)
+        except Exception as error:
+            # Without saved rates there is nothing to convert with
+            if self.content is None:
+                raise
 
-        if response:
-            print(f"Successfully retrieved exchange rates. Status code: {response.status_code}")
-        else:
-            raise Exception(f"Unable to retrieve exchange rates: Error Code {response.status_code}")
+            print(f"{error}. Using exchange rates from {last_update_time_str}.")
+            self.retry_time = datetime.now(timezone.utc).timestamp() + self.RETRY_INTERVAL
+            return
+
+        self.set_rates(data)
+
+    def download(self) -> dict:
+        '''
+        Downloads the exchange rates from self.URL and returns them.
+
+        The HTTP session is reused between downloads. A request that fails or times out is
+        retried self.RETRIES times, waiting self.BACKOFF seconds at first and twice as long after each attempt.
+        '''
+        # Imported here so that requests is never loaded while the saved exchange rates are up to date
+        import requests
+
+        if self.session is None:
+            self.session = requests.Session()
+
+        for attempt in range(self.RETRIES + 1):
+            try:
+                response = self.session.get(self.URL, timeout=self.TIMEOUT)
+            except requests.RequestException as error:
+                message = f"Unable to retrieve exchange rates: {error}"
+            else:
+                if response:
+                    print(f"Successfully retrieved exchange rates. Status code: {response.status_code}")
+                    return response.json()
+
+                message = f"Unable to retrieve exchange rates: Error Code {response.status_code}"
+
+            if attempt == self.RETRIES:
+                raise Exception(message)
+
+            wait = self.BACKOFF * 2 ** attempt
+            print(f"{message}. Retrying in {wait} seconds...")
+            time.sleep(wait)
+
+    def write_rates(self, data: dict):
+        with atomic_write(self.exchange_rate_file, "w") as output_file:
+            json.dump(data, output_file, indent=4)
+
+        if self.history is not None:
+            self.add_to_history(data)
+
+    def add_to_history(self, data: dict):
+        # The rates are already saved to exchange_rate_file, so an error in the history is only reported
+        try:
+            self.history.append(data)
+        except Exception as error:
+            print(f"Unable to add exchange rates to {self.history.path}: {error}")
+
+    def get_rates_at(self, timestamp: float) -> dict:
+        '''
+        Returns the rates that were in effect at `timestamp` (Unix time), read from the rate history.
+
+        The rates in exchange_rate_file are added to the history first, so they can be used even
+        if they were saved before the history existed. No rates are downloaded.
+        Raises ValueError if there is no history or no rates from before `timestamp` are in it.
+        '''
+        if self.history is None:
+            raise ValueError("The exchange rates have no rate history.")
+
+        if self.content is None:
+            self.check_last_update()
+        if self.content is not None:
+            self.add_to_history(self.content)
+
+        return self.history.get_rates(timestamp)
+
+    def set_rates(self, data: dict):
+        # Keep the new rates in memory so they do not have to be read from the file again
+        self.content = data
+        self.last_update_time = data["time_last_update_unix"]
+        self.next_update_time = data["time_next_update_unix"]
+        self.is_outdated = False
+
+    def get_rates(self) -> dict:
+        '''
+        Returns the exchange rates as retrieved from the API. The rates themselves are in the "rates" key.
+
+        The rates are kept in memory after the first call. They are only read from
+        self.exchange_rate_file or downloaded again once `time_next_update_unix` has passed.
+
+        If the download fails, the outdated rates are returned and the download is tried again
+        after self.RETRY_INTERVAL seconds. An error is only raised if there are no rates at all.
+        '''
+        if self.content is not None and self.next_update_time is not None:
+            current_unix_time = datetime.now(timezone.utc).timestamp()
+            if current_unix_time <= self.next_update_time or current_unix_time < self.retry_time:
+                return self.content
+
+        self.update()
+        return self.content
+
+
+class AsyncExchangeRates(ExchangeRates):
+    '''
+    Provides exchange rates to asyncio code without blocking the event loop.
+
+    Once rates have been loaded, `get_rates_async()` and `get_rates()` return them immediately.
+    When `time_next_update_unix` has passed, the stale rates are still returned while new rates
+    are downloaded in the background. Only one download runs at a time, and the file and the
+    network are only accessed from worker threads.
+
+    If a background download fails, the stale rates are kept and the download is tried
+    again after self.RETRY_INTERVAL seconds.
+
+    Example usage:
+
+        exchange_rates = AsyncExchangeRates()
+        rates = await exchange_rates.get_rates_async()
+    '''
+    def __init__(self, exchange_rate_file='exchange_rates.json', url="https://open.er-api.com/v6/latest/USD", history_file=HISTORY_FILE):
+        super().__init__(exchange_rate_file, url, history_file)
+        self.refresh_task = None
+        self.refresh_thread = None
+
+        # Held while rates are loaded or downloaded, so that threads share one download
+        self.refresh_lock = threading.Lock()
+        self.thread_lock = threading.Lock()
+
+    def needs_refresh(self) -> bool:
+        if self.next_update_time is None:
+            return True
+
+        current_unix_time = datetime.now(timezone.utc).timestamp()
+        return current_unix_time > self.next_update_time and current_unix_time >= self.retry_time
+
+    async def get_rates_async(self) -> dict:
+        '''
+        Returns the exchange rates. Waits for them only if no rates have been loaded yet.
+        '''
+        import asyncio
+
+        if self.content is None:
+            await asyncio.to_thread(self.load_rates)
+
+            # The file is missing or unreadable, so the rates must be downloaded before they can be used
+            if self.content is None:
+                await asyncio.shield(self.start_refresh())
+                return self.content
+
+        if self.needs_refresh():
+            self.start_refresh()
+
+        return self.content
+
+    def get_rates(self) -> dict:
+        '''
+        Returns the exchange rates. Waits for them only if no rates have been loaded yet.
+
+        Stale rates are refreshed in the background: in a task if called from a running event
+        loop, or in a thread otherwise.
+        '''
+        if self.content is None:
+            self.load_rates()
+
+            if self.content is None:
+                self.refresh_rates()
+                return self.content
+
+        if self.needs_refresh():
+            try:
+                self.start_refresh()
+            except RuntimeError:
+                # No running event loop
+                self.start_refresh_thread()
+
+        return self.content
+
+    def load_rates(self):
+        # Only the first thread reads the file
+        with self.refresh_lock:
+            if self.content is None:
+                self.check_last_update()
+
+    def start_refresh(self) -> "asyncio.Task":
+        import asyncio
+
+        # Share the download that is already running instead of starting another one
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.refresh_rates))
+        return self.refresh_task
+
+    def start_refresh_thread(self) -> threading.Thread:
+        with self.thread_lock:
+            if self.refresh_thread is None or not self.refresh_thread.is_alive():
+                self.refresh_thread = threading.Thread(target=self.refresh_rates, daemon=True)
+                self.refresh_thread.start()
+            return self.refresh_thread
+
+    def refresh_rates(self):
+        '''
+        Downloads and saves new rates. If another thread is already downloading, waits for its rates
+        when none have been loaded yet, and returns immediately otherwise.
+        '''
+        if not self.refresh_lock.acquire(blocking=self.content is None):
+            return
+
+        try:
+            # Another thread may have downloaded the rates while this one waited
+            if self.content is not None and not self.needs_refresh():
+                return
+
+            try:
+                with PROFILER.stage("rate_refresh"):
+                    data = self.download()
+                    self.write_rates(data)
+            except Exception as error:
+                if self.content is None:
+                    raise
 
-        data = response.json()
+                print(f"{error}. Using exchange rates from {datetime.fromtimestamp(self.last_update_time, UTC).strftime('%Y-%m-%d %H:%M:%SZ')}.")
+                self.retry_time = datetime.now(timezone.utc).timestamp() + self.RETRY_INTERVAL
+                return
 
-        # Write to file
-        output_file = open(self.exchange_rate_file, "w")
-        json.dump(data, output_file, indent=4)
-        output_file.close()
+            self.set_rates(data)
+        finally:
+            self.refresh_lock.release()
 
 if __name__ == '__main__':
     exchange_rates = ExchangeRates()